@@ -1,18 +1,25 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, messagebox
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image, ImageTk
-import os, zipfile, shutil, cv2, numpy as np, re
-from skimage.metrics._structural_similarity import structural_similarity as ssim
-
-OUTPUT_DIR = r"D:\FFOutput"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+import os
+from multiprocessing import freeze_support
+from epub_extract import extract_epub, process_image
+from dedup import open_store
+from jobs import JobRunner
+from book_ops import extract_number, stitch_files, pack_to_digital, pack_to_cbz
+from metrics import metrics
+from preview import ThumbnailCache
+from gallery import GalleryWindow
+
+# 输出目录可以用环境变量 KPS_OUTPUT_DIR 覆盖
+OUTPUT_DIR = os.environ.get('KPS_OUTPUT_DIR', r"D:\FFOutput")
 
 class OptimizedApp(TkinterDnD.Tk):
     def __init__(self):
         super().__init__()
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
         self.title("EPUB to JPG Stitch Tool")
-        self.geometry("400x600")  # 增加窗口高度
+        self.geometry("400x680")  # 增加窗口高度，留出进度条位置
         self.resizable(False, False)
 
         self.create_styles()
@@ -36,12 +43,16 @@ class CombinedFrame(ttk.Frame):
     def __init__(self, master):
         super().__init__(master)
         self.epub_file = None
+        self.book_title = None  # 最近一次处理的 EPUB 的书名，打包 CBZ 时用作文件名
         self.image_paths = []
         self.desc_order = tk.BooleanVar(value=True)
+        self.pack_cbz = tk.BooleanVar(value=False)
         self.max_images = 2
         self.initial_epub_text = "Import EPUB here"
         self.initial_image_text = "Import jpg here (max 2)"
         self.create_widgets()
+        self.runner = JobRunner(self, self.on_job_event)
+        self.thumbnails = ThumbnailCache(self)
 
     def create_widgets(self):
         # EPUB导入区域（上方）
@@ -79,11 +90,15 @@ class CombinedFrame(ttk.Frame):
         control_frame.pack(fill="x", pady=5)
 
         ttk.Checkbutton(control_frame, text="Right to Left", variable=self.desc_order,
-                        command=self.reorder_images).pack(side=tk.LEFT, padx=(100, 10))
+                        command=self.reorder_images).pack(side=tk.LEFT, padx=(40, 10))
 
         self.stitch_button = ttk.Button(control_frame, text="Stitch images", style='ButtonNo2.TButton', command=self.stitch_images)
         self.stitch_button.pack(side=tk.LEFT)
 
+        # 整本书的缩略图浏览，一次标记多对后批量拼接
+        self.gallery_button = ttk.Button(control_frame, text="Gallery", style='ButtonNo2.TButton', command=self.open_gallery)
+        self.gallery_button.pack(side=tk.LEFT, padx=(5, 0))
+
         # 通用功能按钮
         button_frame = ttk.Frame(self)
         button_frame.pack(fill="x", pady=10)
@@ -92,8 +107,23 @@ class CombinedFrame(ttk.Frame):
         self.clear_button.pack(side=tk.LEFT, expand=True, fill="x", padx=(50, 5))
 
         self.pack_button = ttk.Button(button_frame, text="Pack to digital", style='ButtonNo3.TButton', command=self.pack_to_digital)
-        self.pack_button.pack(side=tk.LEFT, expand=True, fill="x", padx=(5, 50))
+        self.pack_button.pack(side=tk.LEFT, expand=True, fill="x", padx=(5, 5))
+
+        # 勾选后直接打包成 CBZ，不再移动到 digital 文件夹
+        ttk.Checkbutton(button_frame, text="CBZ", variable=self.pack_cbz).pack(side=tk.LEFT, padx=(0, 40))
+
+        # 后台任务进度
+        progress_frame = ttk.Frame(self)
+        progress_frame.pack(fill="x", padx=10, pady=5)
 
+        self.progress_bar = ttk.Progressbar(progress_frame, mode='determinate')
+        self.progress_bar.pack(side=tk.LEFT, expand=True, fill="x", padx=(0, 5))
+
+        self.cancel_button = ttk.Button(progress_frame, text="Cancel", command=self.runner_cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT)
+
+        self.progress_label = ttk.Label(self, text="Idle")
+        self.progress_label.pack(fill="x", padx=10)
 
         # 启用拖放功能
         self.epub_frame.drop_target_register(DND_FILES)
@@ -122,9 +152,7 @@ class CombinedFrame(ttk.Frame):
         if remaining_slots > 0:
             new_paths = valid_paths[:remaining_slots]
             self.image_paths.extend(new_paths)
-            self.reorder_images()
-            self.update_image_status()
-            self.show_images()  # 添加这行来显示预览
+            self.reorder_images()  # 会同时刷新状态和预览
         else:
             messagebox.showinfo("maximum of images reached", "maximum of 2 images")
     
@@ -137,13 +165,16 @@ class CombinedFrame(ttk.Frame):
             self.preview_label.pack(expand=True)
             return
 
-        for i, path in enumerate(self.image_paths):
-            img = Image.open(path)
-            img.thumbnail((180, 180))  # 调整预览图片大小
-            photo = ImageTk.PhotoImage(img)
-            label = ttk.Label(self.preview_frame, image=photo)
-            label.image = photo  # 保持对图片的引用
+        for path in self.image_paths:
+            label = ttk.Label(self.preview_frame, text="Loading...")
             label.pack(side=tk.LEFT, padx=5, expand=True)
+            # 缩略图在后台解码并缓存，重新排序或再次拖入同一页时直接复用
+            self.thumbnails.get(path, lambda photo, label=label: self.set_thumbnail(label, photo))
+
+    def set_thumbnail(self, label, photo):
+        if label.winfo_exists():
+            label.config(image=photo, text="")
+            label.image = photo  # 保持对图片的引用
 
     def update_image_status(self):
         if not self.image_paths:
@@ -161,54 +192,31 @@ class CombinedFrame(ttk.Frame):
         self.show_images()  # 添加这行来更新预览
 
     def extract_number(self, path):
-        filename = os.path.splitext(os.path.basename(path))[0]
-        number = re.sub(r'^0+', '', filename)
-        return int(number) if number.isdigit() else filename
+        return extract_number(path)
 
     def update_preview(self):
-        for widget in self.preview_frame.winfo_children():
-            widget.destroy()
-
-        if not self.image_paths:
-            self.preview_label = ttk.Label(self.preview_frame, text=self.initial_image_text, anchor="center", font=('Helvetica', 12))
-            self.preview_label.pack(expand=True)
-            self.image_status_label.config(text="0 image imported")
-        else:
-            for i, path in enumerate(self.image_paths):
-                img = Image.open(path)
-                img.thumbnail((180, 180))
-                photo = ImageTk.PhotoImage(img)
-                label = ttk.Label(self.preview_frame, image=photo)
-                label.image = photo
-                label.pack(side=tk.LEFT, padx=5, expand=True)
-            self.image_status_label.config(text=f"{len(self.image_paths)} image(s) imported")
-
+        self.show_images()
+        self.update_image_status()
 
     def process_epub(self):
         if not self.epub_file:
             messagebox.showerror("ERROR", "No EPUB imported")
             return
 
+        # 任务运行时新拖入的 EPUB 会排队执行
+        epub_file = self.epub_file
+        self.book_title = os.path.splitext(os.path.basename(epub_file))[0]
+        self.runner.submit(os.path.basename(epub_file), self.run_process_epub, epub_file)
+        self.clear_epub()
+
+    def run_process_epub(self, job, epub_file):
+        # 设置了 KPS_STORE 时与命令行共用同一个去重存储；连接在任务线程里打开
+        store = open_store()
         try:
-            zip_file = os.path.splitext(self.epub_file)[0] + '.zip'
-            shutil.copy(self.epub_file, zip_file)
-
-            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                file_list = zip_ref.namelist()
-                images_folders = ['images/'] + [f'{name}images/' for name in file_list if name.endswith('_files/')]
-
-                for images_folder in images_folders:
-                    for file_info in zip_ref.infolist():
-                        if file_info.filename.startswith(images_folder) and file_info.filename.lower().endswith(
-                                ('.jpeg', '.jpg', '.png')):
-                            self.process_image(zip_ref, file_info, images_folder)
-
-            os.remove(zip_file)
-            # messagebox.showinfo("Completed", "EPUB Processed")
-            self.clear_epub()
-        except Exception as e:
-            messagebox.showerror("ERROR", f"Error processing EPUB file: {e}")
-            self.clear_epub()
+            return extract_epub(epub_file, OUTPUT_DIR, progress=job.report, store=store)
+        finally:
+            if store:
+                store.close()
 
     def clear_epub(self):
         self.epub_file = None
@@ -216,68 +224,72 @@ class CombinedFrame(ttk.Frame):
         self.epub_status_label.config(text="No EPUB imported")   
            
     def process_image(self, zip_ref, file_info, images_folder):
-        original_filename = file_info.filename.replace(images_folder, '')
-        new_filename = original_filename.lstrip('0') or '0'
-        new_filename = os.path.splitext(new_filename)[0] + '.jpg'
-        new_filepath = os.path.join(OUTPUT_DIR, new_filename)
-        os.makedirs(os.path.dirname(new_filepath), exist_ok=True)
-
-        with zip_ref.open(file_info) as source, open(new_filepath, 'wb') as target:
-            shutil.copyfileobj(source, target)
-
-        if file_info.filename.lower().endswith('.png'):
-            with Image.open(new_filepath) as img:
-                rgb_img = img.convert('RGB')
-                rgb_img.save(new_filepath, 'JPEG', quality=95)
-        elif file_info.filename.lower().endswith('.jpeg'):
-            os.rename(new_filepath, new_filepath.replace('.jpeg', '.jpg'))
+        return process_image(zip_ref, file_info, images_folder, OUTPUT_DIR)
 
     def stitch_images(self):
         if len(self.image_paths) != 2:
             messagebox.showerror("ERROR", "Please add 2 images before stitching!")
             return
 
-        try:
-            images = [Image.open(path) for path in self.image_paths]
-
-            total_width = sum(img.width for img in images)
-            max_height = max(img.height for img in images)
-
-            result_image = Image.new('RGB', (total_width, max_height))
+        image_paths = list(self.image_paths)
+        self.runner.submit("Stitch", self.run_stitch_images, image_paths)
+        self.after(100, self.clear_images)
 
-            current_width = 0
-            for img in images:
-                result_image.paste(img, (current_width, 0))
-                current_width += img.width
-
-            base_names = [self.extract_number(path) for path in self.image_paths]
-            base_names.sort()  # Sort numbers from small to large
-            output_filename = f"{'-'.join(map(str, base_names))}.jpg"
-            output_dir = os.path.dirname(self.image_paths[0])
-            output_path = os.path.join(output_dir, output_filename)
-
-            result_image.save(output_path, quality=95)
-
-            stitched_dir = os.path.join(output_dir, "Stitched")
-            os.makedirs(stitched_dir, exist_ok=True)
-            for path in self.image_paths:
-                shutil.move(path, stitched_dir)
-
-            # messagebox.showinfo("Completed", "Images stitched successfully")
-            self.after(100, self.clear_images)
-        except Exception as e:
-            messagebox.showerror("ERROR", f"Error while stitching images: {e}")
+    def run_stitch_images(self, job, image_paths):
+        output_path = stitch_files(image_paths)
+        job.report(len(image_paths), len(image_paths))
+        return output_path
 
     def pack_to_digital(self):
-        target_dir = os.path.join(OUTPUT_DIR, "digital")
-        os.makedirs(target_dir, exist_ok=True)
+        if self.pack_cbz.get():
+            self.runner.submit("Pack CBZ", self.run_pack_to_cbz)
+        else:
+            self.runner.submit("Pack", self.run_pack_to_digital)
+
+    def run_pack_to_digital(self, job):
+        return pack_to_digital(OUTPUT_DIR, progress=job.report)
 
-        for item in os.listdir(OUTPUT_DIR):
-            source_item = os.path.join(OUTPUT_DIR, item)
-            if source_item != target_dir:
-                shutil.move(source_item, os.path.join(target_dir, item))
+    def run_pack_to_cbz(self, job):
+        # 与移动到 digital 一样，打包完成后清空输出目录里的页面，方便处理下一本。
+        # 文件名用书名，已有同名文件时报错，不会悄悄替换上一本书的 CBZ
+        cbz_path = os.path.join(OUTPUT_DIR, f"{self.book_title or 'digital'}.cbz")
+        return pack_to_cbz(OUTPUT_DIR, cbz_path, remove_pages=True, progress=job.report, overwrite=False)
 
-        # messagebox.showinfo("Completed", f"All files moved {target_dir}")
+    def open_gallery(self):
+        if not os.path.isdir(OUTPUT_DIR):
+            messagebox.showerror("ERROR", f"{OUTPUT_DIR} does not exist")
+            return
+        GalleryWindow(self, OUTPUT_DIR, self.runner, self.desc_order)
+
+    def runner_cancel(self):
+        self.runner.cancel()
+
+    def on_job_event(self, kind, job, payload):
+        queued = self.runner.pending - (1 if self.runner.current else 0)
+        queued_text = f" (+{queued} queued)" if queued > 0 else ""
+
+        if kind == 'started':
+            self.progress_bar.config(value=0, maximum=1)
+            self.cancel_button.config(state=tk.NORMAL)
+            self.progress_label.config(text=f"{job.name}: starting{queued_text}")
+        elif kind == 'progress':
+            self.progress_bar.config(value=job.done, maximum=max(job.total, 1))
+            eta = job.eta
+            eta_text = f" · ETA {int(eta) // 60}:{int(eta) % 60:02d}" if eta is not None else ""
+            self.progress_label.config(
+                text=f"{job.name}: {job.done}/{job.total} pages · {job.rate:.1f} pages/s{eta_text}{queued_text}")
+        elif kind == 'queued':
+            if self.runner.current is not None:
+                self.progress_label.config(text=f"{self.runner.current.name}: running{queued_text}")
+        else:
+            if kind == 'failed':
+                messagebox.showerror("ERROR", f"Error in {job.name}: {payload}")
+            if metrics.enabled:
+                print(f"{job.name}:\n{metrics.summary()}")
+            status = {'finished': "done", 'cancelled': "cancelled", 'failed': "failed"}[kind]
+            self.progress_label.config(text=f"{job.name}: {status}{queued_text}")
+            if not self.runner.busy:
+                self.cancel_button.config(state=tk.DISABLED)
 
     def clear_images(self):
         self.image_paths = []
@@ -288,5 +300,9 @@ class CombinedFrame(ttk.Frame):
         self.clear_images()
 
 if __name__ == "__main__":
+    freeze_support()
     app = OptimizedApp()
+    if os.environ.get('KPS_STARTUP_PROBE'):
+        # 打包脚本测量启动时间用：窗口第一次画完就退出
+        app.after_idle(lambda: (app.update(), app.destroy()))
     app.mainloop()
\ No newline at end of file
@@ -1,92 +1,363 @@
 import os
+import io
 import shutil
+import argparse
+from functools import partial
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from PIL import Image
 import numpy as np
+from pairing import stride_pairs, choose_pairs
+from manifest import Manifest, write_atomic, file_hash
+from lossless_join import join_jpeg_files
+from metrics import metrics
+from similarity import pair_error, batch_errors, THRESHOLDS, METRICS
+from color_mode import output_mode
+from dedup import link_or_copy, open_store
+from encoder import encode_image, require_jpeg, PROFILES
+from edge_index import EdgeIndex
 
-def mse(imageA, imageB):
-    err = np.sum((imageA.astype("float") - imageB.astype("float")) ** 2)
-    err /= float(imageA.shape[0] * imageA.shape[1])
-    return err
+def edge_strips(fp, edge_width=5, page=None):
+    # 只取左右两条边做灰度，不转换整页；JPEG 用 draft 只解码亮度通道（不缩小尺寸）
+    with Image.open(fp) as img:
+        with metrics.stage('decode', page=page):
+            if img.format == 'JPEG':
+                img.draft('L', img.size)
+            img.load()
+        with metrics.stage('grayscale', page=page):
+            width, height = img.size
+            left = np.array(img.crop((0, 0, edge_width, height)).convert('L'))
+            right = np.array(img.crop((width - edge_width, 0, width, height)).convert('L'))
+    return left, right, (width, height)
 
-def compare_edges(img1, img2, edge_width=5, threshold=50):
-    img1_gray = img1.convert('L')
-    img2_gray = img2.convert('L')
-
-    edge1 = np.array(img1_gray)[:, :edge_width]
-    edge2 = np.array(img2_gray)[:, -edge_width:]
+def strip_error(edge1, edge2, metric='mse'):
+    return pair_error(edge1, edge2, metric)
 
+def compare_strips(edge1, edge2, threshold=50):
     print(f"Edge 1 shape: {edge1.shape}, Edge 2 shape: {edge2.shape}")
 
-    min_height = min(edge1.shape[0], edge2.shape[0])
-    edge1 = edge1[:min_height]
-    edge2 = edge2[:min_height]
-
-    print(f"Adjusted edge shapes: {edge1.shape}, {edge2.shape}")
-
-    error = mse(edge1, edge2)
+    error = strip_error(edge1, edge2)
 
     print(f"MSE between edges: {error}")
     print(f"Threshold: {threshold}")
 
     return error < threshold
 
-def join_images(img1, img2):
+def compare_edges(img1, img2, edge_width=5, threshold=50):
+    edge1 = np.array(img1.crop((0, 0, edge_width, img1.height)).convert('L'))
+    edge2 = np.array(img2.crop((img2.width - edge_width, 0, img2.width, img2.height)).convert('L'))
+    return compare_strips(edge1, edge2, threshold)
+
+def join_images(img1, img2, mode=None):
+    # 两页都是灰度时画布用 L，有一边是彩色才用 RGB
+    mode = mode or output_mode(img1, img2)
     if img1.size[1] != img2.size[1]:
         min_height = min(img1.size[1], img2.size[1])
         img1 = img1.crop((0, 0, img1.size[0], min_height))
         img2 = img2.crop((0, 0, img2.size[0], min_height))
 
-    joined_image = Image.new('RGB', (img1.size[0] + img2.size[0], img1.size[1]))
+    joined_image = Image.new(mode, (img1.size[0] + img2.size[0], img1.size[1]))
 
     joined_image.paste(img2, (0, 0))
     joined_image.paste(img1, (img2.size[0], 0))
 
     return joined_image
 
-def process_images(input_dir, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
+def list_images(input_dir):
+    return sorted([f for f in os.listdir(input_dir) if f.endswith('.jpg') and f[:-4].isdigit()],
+                  key=lambda x: int(x[:-4]))
 
-    images = sorted([f for f in os.listdir(input_dir) if f.endswith('.jpg') and f[:-4].isdigit()],
-                    key=lambda x: int(x[:-4]))
+def consecutive(name1, name2):
+    # 只有页码相连的两页才可能是一个跨页；中间的页已经拼接移走或还没复制进来时不能跳过去配对。
+    # 不是纯数字的文件名无法判断，按相邻处理
+    stem1, stem2 = os.path.splitext(name1)[0], os.path.splitext(name2)[0]
+    return not (stem1.isdigit() and stem2.isdigit()) or int(stem2) == int(stem1) + 1
 
-    print(f"Found {len(images)} images to process")
+def select_pairs(errors, pairing='optimal', threshold=50):
+    if pairing == 'stride':
+        return stride_pairs(errors, threshold)
+    return choose_pairs(errors, threshold)
 
-    for i in range(0, len(images) - 1, 2):
-        if i + 1 >= len(images):
-            print(f"No pair for {images[i]}, processing complete.")
-            break
+def process_images(input_dir, output_dir, workers=1, pairing='optimal', on_result=None, use_manifest=True,
+                   metric='mse', store=None, profile=None, progress=None):
+    # profile 为 encoder 里的 JPEG 编码配置，只用于无法无损拼接、需要重新编码的跨页
+    # progress(done, total) 每解码一页边缘、每拼好一对调用一次
+    require_jpeg(profile)
+    os.makedirs(output_dir, exist_ok=True)
+    join = partial(join_pages, profile=profile) if profile else join_pages
+
+    # 输出目录里的清单记录了页面哈希、比较分数和已完成的拼接，重复运行只处理新页或改过的页
+    manifest = Manifest.open(output_dir) if use_manifest else None
+    try:
+        if manifest:
+            manifest.resume(input_dir, output_dir, join)
 
-        img1_path = os.path.join(input_dir, images[i])
-        img2_path = os.path.join(input_dir, images[i + 1])
+        with metrics.stage('list'):
+            images = list_images(input_dir)
+            index = EdgeIndex.load(input_dir)
 
-        print(f"\nComparing images: {images[i]} and {images[i + 1]}")
+        if workers <= 1:
+            print(f"Found {len(images)} images to process")
+            stitch_book(input_dir, output_dir, images, serial_edges, partial(serial_joins, join=join), pairing,
+                        on_result, manifest, metric, store, profile, index, progress)
+            return
 
-        img1 = Image.open(img1_path)
-        img2 = Image.open(img2_path)
+        print(f"Found {len(images)} images to process with {workers} workers")
+        max_in_flight = workers * 2
+        with ThreadPoolExecutor(max_workers=workers) as io_pool, ProcessPoolExecutor(max_workers=workers) as cpu_pool:
+            def parallel_edges(input_dir, names):
+                def read_page(name):
+                    return read_bytes(os.path.join(input_dir, name)), name
+                return pipelined(io_pool, cpu_pool, read_page, edges_from_bytes, names, max_in_flight)
 
-        print(f"Image 1 size: {img1.size}, Image 2 size: {img2.size}")
+            def parallel_joins(input_dir, images, pairs):
+                def read_pair(i):
+                    img1_path = os.path.join(input_dir, images[i])
+                    img2_path = os.path.join(input_dir, images[i + 1])
+                    return img1_path, img2_path, read_bytes(img1_path), read_bytes(img2_path)
+                return pipelined(io_pool, cpu_pool, read_pair, join, pairs, max_in_flight)
 
-        if compare_edges(img1, img2):
-            new_filename = f"{images[i][:-4]}-{images[i + 1][:-4]}.jpg"
-            print(f"Match found: {new_filename}")
+            stitch_book(input_dir, output_dir, images, parallel_edges, parallel_joins, pairing, on_result, manifest,
+                        metric, store, profile, index, progress)
+    finally:
+        if manifest:
+            manifest.close()
 
-            joined_image = join_images(img1, img2)
+def stitch_book(input_dir, output_dir, images, iter_edges, iter_joins, pairing, on_result, manifest, metric='mse',
+                store=None, profile=None, index=None, progress=None):
+    # 写文件和移动始终按顺序在主线程完成，所以串行和并行的输出文件名和移动结果一致
+    threshold = THRESHOLDS[metric]
+    if progress:
+        iter_edges = with_progress(iter_edges, progress)
+    hashes = page_hashes(input_dir, images, manifest, store, index)
+    # 需要逐对记录误差（on_result）时算精确值，否则超过阈值的页对提前淘汰
+    errors = score_images(input_dir, images, iter_edges, hashes, [cache for cache in (manifest, store) if cache],
+                          metric, None if on_result else threshold, index)
+    report_scores(images, errors, on_result, threshold)
 
-            joined_image_path = os.path.join(input_dir, new_filename)
-            joined_image.save(joined_image_path)
-            print(f"Saved joined image: {joined_image_path}")
+    # 共享存储里已有同样两页的拼接结果时直接硬链接，不再拼接
+    pairs = select_pairs(errors, pairing, threshold)
+    known = {i: store.lookup_join(hashes[i], hashes[i + 1], profile) for i in pairs} if store else {}
+    known = {i: object_path for i, object_path in known.items() if object_path}
+    computed = iter_joins(input_dir, images, [i for i in pairs if i not in known])
 
-            # 移动原始图片到Stitched文件夹
-            shutil.move(img1_path, os.path.join(output_dir, images[i]))
-            shutil.move(img2_path, os.path.join(output_dir, images[i + 1]))
-            print(f"Moved {images[i]} and {images[i + 1]} to {output_dir}")
+    for done, i in enumerate(pairs, 1):
+        joined_data = None if i in known else next(computed)[1]
+        name1, name2 = images[i], images[i + 1]
+        new_filename = f"{name1[:-4]}-{name2[:-4]}.jpg"
+        joined_image_path = os.path.join(input_dir, new_filename)
+
+        if manifest:
+            manifest.set_state(name1, name2, 'started', new_filename, errors[i], (hashes[i], hashes[i + 1]))
+        if joined_data is None:
+            link_or_copy(known[i], joined_image_path)
+            print(f"Linked known joined image: {joined_image_path} ({metric} {errors[i]:.2f})")
         else:
-            print("No match found")
+            write_atomic(joined_image_path, joined_data)
+            print(f"Saved joined image: {joined_image_path} ({metric} {errors[i]:.2f})")
+            if store:
+                store.add_join(hashes[i], hashes[i + 1], joined_image_path, profile)
+        if manifest:
+            manifest.set_state(name1, name2, 'joined')
+
+        # 移动原始图片到Stitched文件夹
+        with metrics.stage('move', pair=new_filename):
+            shutil.move(os.path.join(input_dir, name1), os.path.join(output_dir, name1))
+            shutil.move(os.path.join(input_dir, name2), os.path.join(output_dir, name2))
+        if manifest:
+            manifest.set_state(name1, name2, 'done')
+        if progress:
+            progress(done, len(pairs))
+
+def with_progress(iter_edges, progress):
+    # 包装 iter_edges，每产出一页的边缘调用一次 progress(done, total)
+    def counted(input_dir, names):
+        for done, item in enumerate(iter_edges(input_dir, names), 1):
+            progress(done, len(names))
+            yield item
+    return counted
+
+def page_hashes(input_dir, images, manifest=None, store=None, index=None):
+    # 边缘索引里记录了解压时算好的文件哈希，文件没变的页不用再读
+    known = index.hashes(images) if index else {}
+    if manifest:
+        return manifest.page_hashes(input_dir, images, known)
+    if store:
+        hashes = []
+        for name in images:
+            if name in known:
+                hashes.append(known[name])
+                continue
+            with metrics.stage('hash', page=name):
+                hashes.append(file_hash(os.path.join(input_dir, name)))
+        return hashes
+    return None
+
+def score_images(input_dir, images, iter_edges, hashes=None, caches=(), metric='mse', threshold=None, index=None):
+    # caches 为清单和/或共享存储，按顺序查找已有分数，新算的分数写回所有缓存。
+    # 不给 threshold（需要逐对精确误差）时不用缓存里提前淘汰留下的下界
+    errors = [None] * max(len(images) - 1, 0)
+    gaps = 0
+    for i in range(len(errors)):
+        if not consecutive(images[i], images[i + 1]):
+            errors[i] = float('inf')
+            gaps += 1
+            continue
+        for cache in caches:
+            errors[i] = cache.get_score(hashes[i], hashes[i + 1], metric=metric, exact=threshold is None)
+            if errors[i] is not None:
+                break
+
+    # 只解码缺少分数的页对涉及的页；每页只解码一次边缘，同时用于它和前后两页的比较。
+    # 知道哈希时，内容相同的页对（例如连续的空白页）只算一次，内容相同的页也只解码一次
+    missing = [i for i, error in enumerate(errors) if error is None]
+    if hashes:
+        unique_pairs = {}
+        for i in missing:
+            unique_pairs.setdefault((hashes[i], hashes[i + 1]), i)
+        compute = list(unique_pairs.values())
+        first_page = {}
+        for j in sorted({j for i in compute for j in (i, i + 1)}):
+            first_page.setdefault(hashes[j], j)
+        source = {j: first_page[hashes[j]] for i in compute for j in (i, i + 1)}
+    else:
+        compute = missing
+        source = {j: j for i in compute for j in (i, i + 1)}
+    needed = [images[j] for j in sorted(set(source.values()))]
+    edges = indexed_edges(index, needed)
+    from_index = len(edges)
+    edges.update(iter_edges(input_dir, [name for name in needed if name not in edges]))
+
+    # 所有缺少分数的页对一次批量计算
+    with metrics.stage('compare', pairs=len(compute)):
+        scores = batch_errors([(edges[images[source[i]]][0], edges[images[source[i + 1]]][1]) for i in compute],
+                              metric, threshold)
+    for i, error in zip(compute, scores):
+        errors[i] = error
+    if hashes:
+        for i in missing:
+            errors[i] = errors[unique_pairs[(hashes[i], hashes[i + 1])]]
+    if caches and missing:
+        # 低于阈值的一定是算完的精确值；其余的在会提前淘汰的指标下只是下界，分开记录
+        bounded = threshold is not None and METRICS[metric][2]
+        exact = [i for i in compute if not bounded or errors[i] < threshold]
+        bounds = [i for i in compute if bounded and errors[i] >= threshold]
+        for cache in caches:
+            cache.put_scores([(hashes[i], hashes[i + 1], errors[i]) for i in exact], metric=metric)
+            cache.put_scores([(hashes[i], hashes[i + 1], errors[i]) for i in bounds], metric=metric, exact=False)
+    print(f"Reused {len(errors) - len(missing) - gaps} cached scores, skipped {gaps} pairs across page-number gaps, "
+          f"decoded edges of {len(needed) - from_index} pages "
+          f"({from_index} more from the edge index)")
+    return errors
+
+def indexed_edges(index, names):
+    # 边缘索引里有、且文件没改过的页直接把索引里的字节当作数组用，不打开 JPEG
+    edges = {}
+    for name in names if index else ():
+        record = index.get(name)
+        if record:
+            width, height = record['size']
+            edges[name] = (np.frombuffer(record['left'], np.uint8).reshape(height, -1),
+                           np.frombuffer(record['right'], np.uint8).reshape(height, -1), (width, height))
+    return edges
+
+def serial_edges(input_dir, names):
+    for name in names:
+        yield name, edge_strips(os.path.join(input_dir, name), page=name)
+
+def serial_joins(input_dir, images, pairs, join=None):
+    join = join or join_pages
+    for i in pairs:
+        # 只有确定拼接时才完整解码
+        yield i, join(os.path.join(input_dir, images[i]), os.path.join(input_dir, images[i + 1]))
+
+def report_scores(images, errors, on_result=None, threshold=50):
+    matched = sum(error < threshold for error in errors)
+    print(f"Scored {len(errors)} adjacent pairs, {matched} below threshold {threshold}")
+    if on_result:
+        for i, error in enumerate(errors):
+            on_result(images[i], images[i + 1], error, error < threshold)
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def edges_from_bytes(data, page=None, edge_width=5):
+    return edge_strips(io.BytesIO(data), edge_width, page)
+
+def join_pages(img1_path, img2_path, data1=None, data2=None, profile=None):
+    # 两页都是参数一致的基线 JPEG 时直接在 DCT 域拼接（img2 在左），否则才完整解码再编码
+    pair = f"{os.path.basename(img1_path)}-{os.path.basename(img2_path)}"
+    with metrics.stage('join', pair=pair, mode='lossless'):
+        joined_data = join_jpeg_files(img2_path, img1_path)
+    if joined_data is not None:
+        return joined_data
+
+    with metrics.stage('decode', pair=pair):
+        img1 = Image.open(io.BytesIO(data1) if data1 is not None else img1_path)
+        img2 = Image.open(io.BytesIO(data2) if data2 is not None else img2_path)
+        img1.load()
+        img2.load()
+    with metrics.stage('join', pair=pair):
+        joined_image = join_images(img1, img2)
+    with metrics.stage('encode', pair=pair, image_mode=joined_image.mode, profile=profile):
+        return encode_image(joined_image, profile, sources=(img1, img2))
+
+def pipelined(io_pool, cpu_pool, read, work, items, max_in_flight):
+    # 读文件在线程池里预取，计算在进程池里做，结果按输入顺序产出；
+    # 同时在处理中的任务数有上限，内存占用不随书的页数增长
+    def prefetch(item):
+        return cpu_pool.submit(work, *read(item))
+
+    in_flight = deque()
+    for item in items:
+        in_flight.append((item, io_pool.submit(prefetch, item)))
+        if len(in_flight) >= max_in_flight:
+            item, future = in_flight.popleft()
+            yield item, future.result().result()
+
+    while in_flight:
+        item, future = in_flight.popleft()
+        yield item, future.result().result()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Automatically stitch two-page spreads")
+    parser.add_argument('input_directory', nargs='?', default=r"D:\FFOutput")
+    parser.add_argument('output_directory', nargs='?', default=None)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of worker processes (1 = serial)")
+    parser.add_argument('--pairing', choices=['optimal', 'stride'], default='optimal',
+                        help="optimal: best non-overlapping pairs over the whole book; "
+                             "stride: the old fixed (0,1), (2,3), ... pairing")
+    parser.add_argument('--similarity', choices=['mse', 'ncc', 'gradient'], default='mse',
+                        help="edge similarity metric (default: mse)")
+    parser.add_argument('--profile', choices=[name for name, profile in PROFILES.items() if profile['format'] == 'JPEG'],
+                        help="encoder profile for spreads that cannot be joined losslessly (default: PIL defaults)")
+    parser.add_argument('--store', metavar='DIR',
+                        help="shared content store for skipping pages and pairs seen in other books (default: $KPS_STORE)")
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="record per-stage timings to PATH (.jsonl or .csv) and print a summary")
+    parser.add_argument('--no-manifest', dest='use_manifest', action='store_false',
+                        help="do not read or write the resumable manifest in the output directory")
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable(args.metrics)
+    if args.output_directory is None:
+        args.output_directory = os.path.join(args.input_directory, "Stitched")
+    return args
 
 if __name__ == "__main__":
-    input_directory = r"D:\FFOutput"
-    output_directory = r"D:\FFOutput\Stitched"
+    args = parse_args()
+    input_directory = args.input_directory
+    output_directory = args.output_directory
     print(f"Processing images from {input_directory}")
     print(f"Output directory: {output_directory}")
-    process_images(input_directory, output_directory)
+    store = open_store(args.store)
+    try:
+        process_images(input_directory, output_directory, args.workers, args.pairing, use_manifest=args.use_manifest,
+                       metric=args.similarity, store=store, profile=args.profile)
+    finally:
+        if store:
+            store.close()
     print("Processing complete")
+    metrics.finish()
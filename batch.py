@@ -0,0 +1,368 @@
+import os
+import time
+import shutil
+import socket
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+
+# 批量处理大量 EPUB：任务记在本地 SQLite 队列里，多个工作进程各自领取一本书，
+# 依次解压、自动拼接、打包到这本书自己的输出目录。领取的任务有租约，工作进程崩溃或卡死时
+# 租约过期后由别的进程重试（卡死的进程由协调进程结束）；每次尝试都写在单独的临时目录里，只有仍持有租约的进程才能把它改名为
+# 最终目录，所以两本书（或同一本书的两次尝试）不会写进同一个文件夹。
+
+QUEUE_NAME = '.kindlepicstitch-queue.sqlite'
+JOB_MARKER = '.kindlepicstitch-job'
+
+
+def find_epubs(paths):
+    # 参数可以是 EPUB 文件，也可以是目录（递归查找其中的 .epub）
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                found.extend(os.path.join(root, name) for name in files if name.lower().endswith('.epub'))
+        else:
+            found.append(path)
+    return sorted(os.path.abspath(path) for path in found)
+
+
+def staging_dir(output_dir, attempt):
+    return f"{output_dir}.part-{attempt}"
+
+
+def mark_job_dir(directory, job_id):
+    # 队列建的目录里放一个记着任务号的标记文件，删除或替换目录前用 owned_by 确认是自己的
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, JOB_MARKER), 'w') as f:
+        f.write(str(job_id))
+
+
+def owned_by(directory, job_id):
+    try:
+        with open(os.path.join(directory, JOB_MARKER)) as f:
+            return f.read().strip() == str(job_id)
+    except OSError:
+        return False
+
+
+class JobQueue:
+    # SQLite 里的持久任务队列，协调进程和所有工作进程共用；每个任务独占一个输出目录，领取时带租约
+
+    def __init__(self, path):
+        self.path = path
+        # 自己管理事务：领取和完成都用 BEGIN IMMEDIATE，多个进程同时领取时不会领到同一本书
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY, epub TEXT UNIQUE, output_dir TEXT UNIQUE, state TEXT,
+                attempts INTEGER DEFAULT 0, lease_owner TEXT, lease_expires REAL,
+                pages INTEGER, extract_s REAL, stitch_s REAL, pack_s REAL, seconds REAL,
+                started REAL, finished REAL, error TEXT);
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def add(self, epub_paths, output_root):
+        # 已经在队列里的书不重复添加；书名相同的不同文件，或输出目录里已经有同名的文件夹（不是队列建的，
+        # 比如 GUI 的 Stitched），在目录名后加路径哈希，各写各的目录
+        added = 0
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for epub in epub_paths:
+                if self.db.execute('SELECT 1 FROM jobs WHERE epub = ?', (epub,)).fetchone():
+                    continue
+                output_dir = os.path.join(output_root, os.path.splitext(os.path.basename(epub))[0])
+                if os.path.exists(output_dir) or \
+                        self.db.execute('SELECT 1 FROM jobs WHERE output_dir = ?', (output_dir,)).fetchone():
+                    output_dir += '-' + hashlib.sha1(epub.encode('utf-8')).hexdigest()[:8]
+                self.db.execute("INSERT INTO jobs (epub, output_dir, state) VALUES (?, ?, 'queued')", (epub, output_dir))
+                added += 1
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return added
+
+    def retry_failed(self):
+        return self.db.execute("UPDATE jobs SET state = 'queued', attempts = 0, error = NULL "
+                               "WHERE state = 'failed'").rowcount
+
+    def claim(self, owner, lease, max_attempts):
+        # 返回 (id, epub, 输出目录, 第几次尝试)；没有可领取的任务时返回 None
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            # 租约过期、已经用完重试次数的任务不再重试
+            self.db.execute("UPDATE jobs SET state = 'failed', lease_owner = NULL, "
+                            "error = COALESCE(error, 'lease expired') "
+                            "WHERE state = 'running' AND lease_expires < ? AND attempts >= ?", (now, max_attempts))
+            row = self.db.execute("SELECT id, epub, output_dir, attempts FROM jobs "
+                                  "WHERE state = 'queued' OR (state = 'running' AND lease_expires < ?) "
+                                  "ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_owner = ?, "
+                                "lease_expires = ?, started = ? WHERE id = ?", (owner, now + lease, now, row[0]))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return None if row is None else (row[0], row[1], row[2], row[3] + 1)
+
+    def renew(self, job_id, owner, lease):
+        # 租约已经被别的进程接手时返回 False
+        return self.db.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND state = 'running'",
+                               (time.time() + lease, job_id, owner)).rowcount == 1
+
+    def complete(self, job_id, owner, staging, output_dir, timings):
+        # 持有租约时把临时目录改名为最终目录并记为完成；改名和状态更新在同一个写事务里。
+        # 最终目录只有是同一任务以前改名过去的（改名后、提交前崩溃）才替换，否则抛出 FileExistsError
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            if not self.db.execute("SELECT 1 FROM jobs WHERE id = ? AND lease_owner = ? AND state = 'running'",
+                                   (job_id, owner)).fetchone():
+                self.db.execute('ROLLBACK')
+                return False
+            if os.path.exists(output_dir):
+                if not owned_by(output_dir, job_id):
+                    raise FileExistsError(f"{output_dir} already exists and was not written by this job")
+                shutil.rmtree(output_dir)
+            mark_job_dir(staging, job_id)  # 打包成 digital 时标记文件会跟着移走
+            os.replace(staging, output_dir)
+            self.db.execute("UPDATE jobs SET state = 'done', lease_owner = NULL, finished = ?, error = NULL, "
+                            "pages = ?, extract_s = ?, stitch_s = ?, pack_s = ?, seconds = ? WHERE id = ?",
+                            (time.time(), timings['pages'], timings['extract_s'], timings['stitch_s'],
+                             timings['pack_s'], timings['seconds'], job_id))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return True
+
+    def fail(self, job_id, owner, error, max_attempts):
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                        "lease_owner = NULL, error = ? WHERE id = ? AND lease_owner = ?",
+                        (max_attempts, error, job_id, owner))
+
+    def release(self, owner):
+        # 工作进程异常退出时立即让它的租约过期，不必等满租约时间
+        return self.db.execute("UPDATE jobs SET lease_expires = 0 WHERE lease_owner = ? AND state = 'running'",
+                               (owner,)).rowcount
+
+    def counts(self):
+        return dict(self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def live_owners(self):
+        # 持有未过期租约的工作进程
+        return {row[0] for row in self.db.execute("SELECT lease_owner FROM jobs WHERE state = 'running' "
+                                                  "AND lease_expires >= ?", (time.time(),))}
+
+    def claimable(self):
+        return self.db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued' OR "
+                               "(state = 'running' AND lease_expires < ?)", (time.time(),)).fetchone()[0]
+
+    def report(self):
+        return self.db.execute('SELECT epub, output_dir, state, attempts, pages, extract_s, stitch_s, pack_s, seconds, '
+                               'started, finished, error FROM jobs ORDER BY id').fetchall()
+
+
+def worker_owner(pid=None):
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+class Heartbeat:
+    # 后台线程在任务有进展时续租；超过 stall 秒没有 beat() 就不再续租，卡死的进程因此失去租约
+
+    def __init__(self, queue_path, job_id, owner, lease, stall):
+        self.stop = threading.Event()
+        self.lost = False
+        self.last_beat = time.monotonic()
+        self.thread = threading.Thread(target=self.run, args=(queue_path, job_id, owner, lease, stall), daemon=True)
+        self.thread.start()
+
+    def beat(self, *args):
+        # 也用作 extract_epub 的 progress(done, total) 回调
+        self.last_beat = time.monotonic()
+
+    def run(self, queue_path, job_id, owner, lease, stall):
+        queue = JobQueue(queue_path)  # SQLite 连接不能跨线程使用
+        try:
+            while not self.stop.wait(lease / 3):
+                if time.monotonic() - self.last_beat > stall:
+                    print(f"[{owner}] no progress for {stall:.0f}s, letting the lease on job {job_id} expire", flush=True)
+                    return
+                if not queue.renew(job_id, owner, lease):
+                    self.lost = True
+                    return
+        finally:
+            queue.close()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+
+def process_book(epub, book_dir, options, store, beat=None):
+    # 一本书的完整流程；书内串行，并行度来自同时处理多本书。beat() 在每解压、比较、拼接、打包一页（或一对）
+    # 和每个阶段之后调用一次，耗时长的阶段也不会被当成卡死
+    beat = beat or (lambda *args: None)
+    from epub_extract import extract_epub
+    from ImgStitchAuto import process_images
+    from book_ops import pack_to_digital, pack_to_cbz
+
+    timings = {}
+    started = time.perf_counter()
+    pages = extract_epub(epub, book_dir, workers=1, store=store, progress=beat)
+    timings['extract_s'] = time.perf_counter() - started
+    beat()
+
+    mark = time.perf_counter()
+    process_images(book_dir, os.path.join(book_dir, "Stitched"), 1, options['pairing'], metric=options['metric'],
+                   store=store, profile=options['profile'], progress=beat)
+    timings['stitch_s'] = time.perf_counter() - mark
+    beat()
+
+    mark = time.perf_counter()
+    if options['pack'] == 'cbz':
+        title = os.path.splitext(os.path.basename(epub))[0]
+        pack_to_cbz(book_dir, os.path.join(book_dir, f"{title}.cbz"), progress=beat)
+    elif options['pack'] == 'digital':
+        pack_to_digital(book_dir, progress=beat)
+    timings['pack_s'] = time.perf_counter() - mark
+    timings['pages'] = len(pages)
+    timings['seconds'] = time.perf_counter() - started
+    return timings
+
+
+def worker_main(queue_path, options):
+    # 工作进程：不断领取任务，直到没有可领取的为止
+    from dedup import open_store
+
+    owner = worker_owner()
+    queue = JobQueue(queue_path)
+    store = open_store(options['store'])
+    try:
+        while True:
+            job = queue.claim(owner, options['lease'], options['max_attempts'])
+            if job is None:
+                return
+            job_id, epub, output_dir, attempt = job
+            staging = staging_dir(output_dir, attempt)
+            try:
+                if os.path.exists(staging):
+                    if not owned_by(staging, job_id):
+                        raise FileExistsError(f"{staging} already exists and was not written by this job")
+                    shutil.rmtree(staging)
+                mark_job_dir(staging, job_id)
+            except OSError as e:
+                # 不是队列建的目录不碰，这本书直接记为失败，重试也没有用
+                print(f"[{owner}] failed {epub}: {e}", flush=True)
+                queue.fail(job_id, owner, f"{type(e).__name__}: {e}", 0)
+                continue
+            heartbeat = Heartbeat(queue_path, job_id, owner, options['lease'], options['stall'])
+            try:
+                timings = process_book(epub, staging, options, store, heartbeat.beat)
+            except Exception as e:
+                heartbeat.close()
+                print(f"[{owner}] failed {epub} (attempt {attempt}): {e}", flush=True)
+                queue.fail(job_id, owner, f"{type(e).__name__}: {e}", options['max_attempts'])
+                shutil.rmtree(staging, ignore_errors=True)
+                continue
+            heartbeat.close()
+            try:
+                completed = queue.complete(job_id, owner, staging, output_dir, timings)
+            except FileExistsError as e:
+                print(f"[{owner}] failed {epub}: {e}", flush=True)
+                queue.fail(job_id, owner, f"{type(e).__name__}: {e}", 0)
+                shutil.rmtree(staging, ignore_errors=True)
+                continue
+            if completed:
+                # 之前失败或被接手的尝试留下的临时目录
+                for previous in range(1, attempt):
+                    if owned_by(staging_dir(output_dir, previous), job_id):
+                        shutil.rmtree(staging_dir(output_dir, previous), ignore_errors=True)
+                print(f"[{owner}] {os.path.basename(epub)}: {timings['pages']} pages in {timings['seconds']:.1f}s "
+                      f"({timings['pages'] / timings['seconds']:.1f} pages/s)", flush=True)
+            else:
+                print(f"[{owner}] lost the lease on {epub}, discarding this attempt", flush=True)
+                shutil.rmtree(staging, ignore_errors=True)
+    finally:
+        if store:
+            store.close()
+        queue.close()
+
+
+def run_batch(queue_path, processes, options, poll=1.0):
+    # 协调进程：保持 processes 个工作进程，异常退出的进程释放租约后由新进程补上，队列清空后返回。
+    # 工作进程只在两次领取之间短暂不持有租约；超过一个租约时长仍没有有效租约（卡死后租约已过期，
+    # 或书已被别的进程接手）的进程直接结束
+    queue = JobQueue(queue_path)
+    workers = []
+    idle_since = {}
+    try:
+        while True:
+            live = queue.live_owners()
+            now = time.monotonic()
+            for worker in workers:
+                if not worker.is_alive() or worker_owner(worker.pid) in live:
+                    idle_since.pop(worker.pid, None)
+                elif now - idle_since.setdefault(worker.pid, now) > options['lease']:
+                    print(f"Worker {worker.pid} holds no live lease, terminating it")
+                    worker.terminate()
+                    worker.join()
+            for worker in [worker for worker in workers if not worker.is_alive()]:
+                workers.remove(worker)
+                idle_since.pop(worker.pid, None)
+                if worker.exitcode != 0:
+                    released = queue.release(worker_owner(worker.pid))
+                    print(f"Worker {worker.pid} exited with code {worker.exitcode}, released {released} job(s)")
+            counts = queue.counts()
+            if not counts.get('queued') and not counts.get('running'):
+                break
+            for _ in range(min(processes - len(workers), queue.claimable())):
+                worker = multiprocessing.Process(target=worker_main, args=(queue_path, options))
+                worker.start()
+                workers.append(worker)
+            time.sleep(poll)
+    finally:
+        # 队列清空后还活着的进程只可能是正在退出或已经卡死的
+        for worker in workers:
+            worker.join(options['lease'])
+            if worker.is_alive():
+                print(f"Worker {worker.pid} did not exit, terminating it")
+                worker.terminate()
+                worker.join()
+            if worker.exitcode != 0:
+                queue.release(worker_owner(worker.pid))
+        queue.close()
+
+
+def print_report(queue_path):
+    queue = JobQueue(queue_path)
+    try:
+        rows = queue.report()
+        counts = queue.counts()
+    finally:
+        queue.close()
+
+    print(f"{'book':<40} {'state':<8} {'try':>3} {'pages':>6} {'extract':>8} {'stitch':>8} {'pack':>6} {'pages/s':>8}")
+    for epub, _, state, attempts, pages, extract_s, stitch_s, pack_s, seconds, _, _, error in rows:
+        name = os.path.splitext(os.path.basename(epub))[0][:40]
+        if state == 'done':
+            print(f"{name:<40} {state:<8} {attempts:>3} {pages:>6} {extract_s:>7.1f}s {stitch_s:>7.1f}s "
+                  f"{pack_s:>5.1f}s {pages / seconds if seconds else 0:>8.1f}")
+        else:
+            print(f"{name:<40} {state:<8} {attempts:>3}" + (f"  {error}" if error else ''))
+
+    done = [row for row in rows if row[2] == 'done']
+    summary = ', '.join(f"{state} {count}" for state, count in sorted(counts.items()))
+    if done:
+        # 总吞吐量按墙钟时间算：最早开始到最晚完成，多进程时应随进程数近似线性增长
+        pages = sum(row[4] for row in done)
+        wall = max(row[10] for row in done) - min(row[9] for row in done)
+        summary += f"; {pages} pages in {wall:.1f}s wall ({pages / wall if wall else 0:.1f} pages/s)"
+    print(summary)
@@ -0,0 +1,279 @@
+import os
+import io
+import sys
+import json
+import time
+import zipfile
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from PIL import Image
+import numpy as np
+
+from epub_extract import extract_epub
+from ImgStitchAuto import edge_strips, strip_error, compare_edges, join_images, list_images
+from similarity import batch_errors, METRICS, THRESHOLDS
+from encoder import encode_image, PROFILES
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_kb():
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        scale = 1 if sys.platform != 'darwin' else 1 / 1024  # macOS 返回字节
+        return int(max(usage, children) * scale)
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset // 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def spread_pixels(rng, width, height, grayscale):
+    # 平滑的正弦图案，切成两半后边缘自然衔接，用来模拟真正的跨页
+    y, x = np.mgrid[0:height, 0:width * 2]
+    freqs = rng.random(3) * 0.008 + 0.002
+    channels = 1 if grayscale else 3
+    planes = [127 + 120 * np.sin(x * freqs[c] + y * freqs[(c + 1) % 3]) for c in range(channels)]
+    pixels = np.stack(planes, -1).astype(np.uint8)
+    return pixels[..., 0] if grayscale else pixels
+
+
+def page_bytes(pixels, fmt):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+def make_book(epub_path, pages, size, png_ratio=0.3, spread_ratio=0.6, grayscale=True, seed=0):
+    # 生成合成 EPUB：images/0001.jpg ...，混合 JPEG/PNG、真跨页和不匹配的单页
+    rng = np.random.default_rng(seed)
+    width, height = size
+    spreads = 0
+    with zipfile.ZipFile(epub_path, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr('mimetype', 'application/epub+zip')
+        index = 1
+        while index <= pages:
+            if index < pages and rng.random() < spread_ratio:
+                pixels = spread_pixels(rng, width, height, grayscale)
+                halves = [pixels[:, width:], pixels[:, :width]]  # 右到左：先右半页
+                spreads += 1
+            else:
+                shape = (height, width) if grayscale else (height, width, 3)
+                halves = [rng.integers(0, 256, shape, dtype=np.uint8)]
+            for half in halves:
+                fmt = 'PNG' if rng.random() < png_ratio else 'JPEG'
+                ext = 'png' if fmt == 'PNG' else 'jpg'
+                zf.writestr(f'images/{index:04d}.{ext}', page_bytes(half, fmt))
+                index += 1
+    return spreads
+
+
+def timed(func, *args, **kwargs):
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def bench_extract(epub_path, output_dir, workers):
+    written, wall, cpu = timed(extract_epub, epub_path, output_dir, workers)
+    return {
+        'pages': len(written),
+        'workers': workers,
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'pages_per_s': len(written) / wall if wall else None,
+        'epub_bytes': os.path.getsize(epub_path),
+        'output_bytes': sum(os.path.getsize(path) for path in written),
+    }
+
+
+def bench_compare(page_dir):
+    images = list_images(page_dir)
+    paths = [os.path.join(page_dir, name) for name in images]
+
+    edges, strip_wall, _ = timed(lambda: [edge_strips(path) for path in paths])
+    pairs = [(edges[i][0], edges[i + 1][1]) for i in range(len(edges) - 1)]
+    errors, score_wall, _ = timed(lambda: [strip_error(edge1, edge2) for edge1, edge2 in pairs])
+    # 整本书的页对一次批量计算：精确值、带提前淘汰，以及其他指标
+    batch_walls = {}
+    for metric in METRICS:
+        _, batch_walls[metric], _ = timed(lambda: batch_errors(pairs, metric))
+    _, early_wall, _ = timed(lambda: batch_errors(pairs, 'mse', THRESHOLDS['mse']))
+
+    # 参考：原来的整页灰度比较（关掉它的 print 输出）
+    def full_compare():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(len(paths) - 1):
+                compare_edges(Image.open(paths[i]), Image.open(paths[i + 1]))
+    _, full_wall, _ = timed(full_compare)
+
+    pair_count = max(len(paths) - 1, 1)
+    return {
+        'pairs': len(paths) - 1,
+        'edge_decode_ms_per_page': strip_wall * 1000 / max(len(paths), 1),
+        'score_ms_per_pair': score_wall * 1000 / pair_count,
+        'batch_ms_per_book': {metric: wall * 1000 for metric, wall in batch_walls.items()},
+        'batch_early_exit_ms_per_book': early_wall * 1000,
+        'full_compare_ms_per_pair': full_wall * 1000 / pair_count,
+        'matches': int(sum(error < 50 for error in errors)),
+    }
+
+
+def bench_join(page_dir, limit=20):
+    images = list_images(page_dir)
+    decode_wall = encode_wall = 0.0
+    encoded_bytes = 0
+    count = 0
+    for i in range(0, min(len(images) - 1, limit * 2), 2):
+        img1 = Image.open(os.path.join(page_dir, images[i]))
+        img2 = Image.open(os.path.join(page_dir, images[i + 1]))
+        joined, wall, _ = timed(join_images, img1, img2)
+        decode_wall += wall
+        buffer = io.BytesIO()
+        _, wall, _ = timed(joined.save, buffer, 'JPEG')
+        encode_wall += wall
+        encoded_bytes += buffer.tell()
+        count += 1
+    return {
+        'joins': count,
+        'join_ms': decode_wall * 1000 / max(count, 1),
+        'encode_ms': encode_wall * 1000 / max(count, 1),
+        'bytes_per_spread': encoded_bytes // max(count, 1),
+    }
+
+
+def bench_encode(page_dir, profiles, limit=10):
+    # 每种编码配置对同一批跨页编码，记录编码耗时和写出的字节数，方便在速度和体积之间取舍
+    images = list_images(page_dir)
+    spreads = []
+    for i in range(0, min(len(images) - 1, limit * 2), 2):
+        img1 = Image.open(os.path.join(page_dir, images[i]))
+        img2 = Image.open(os.path.join(page_dir, images[i + 1]))
+        img1.load()
+        img2.load()
+        spreads.append((join_images(img1, img2), (img1, img2)))
+
+    results = {}
+    for profile in [None] + list(profiles):
+        try:
+            encoded, wall, _ = timed(lambda: [encode_image(joined, profile, sources) for joined, sources in spreads])
+        except (OSError, KeyError, ValueError) as e:  # 例如 Pillow 没有编译 AVIF 支持
+            results[profile or 'default'] = {'error': str(e)}
+            continue
+        total_bytes = sum(len(data) for data in encoded)
+        results[profile or 'default'] = {
+            'encode_ms_per_spread': wall * 1000 / max(len(spreads), 1),
+            'bytes_per_spread': total_bytes // max(len(spreads), 1),
+            'mb_per_s': total_bytes / wall / 1e6 if wall else None,
+        }
+    return results
+
+
+def run_case(work_dir, pages, size, png_ratio, grayscale, workers, seed, profiles=()):
+    case_dir = tempfile.mkdtemp(dir=work_dir)
+    epub_path = os.path.join(case_dir, 'book.epub')
+    spreads = make_book(epub_path, pages, size, png_ratio, grayscale=grayscale, seed=seed)
+
+    page_dir = os.path.join(case_dir, 'pages')
+    result = {
+        'pages': pages,
+        'size': list(size),
+        'png_ratio': png_ratio,
+        'grayscale': grayscale,
+        'true_spreads': spreads,
+        'extract': bench_extract(epub_path, page_dir, workers),
+    }
+    result['compare'] = bench_compare(page_dir)
+    result['join'] = bench_join(page_dir)
+    result['encode'] = bench_encode(page_dir, profiles)
+    return result
+
+
+def run_isolated(args, case):
+    # 每个用例在单独的子进程里跑，峰值内存互不影响
+    cmd = [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case), '--work-dir', args.work_dir]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless benchmark for extraction, comparison and stitching")
+    parser.add_argument('--pages', type=int, nargs='+', default=[40, 200])
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[(800, 1200), (1600, 2400)])
+    parser.add_argument('--png-ratio', type=float, nargs='+', default=[0.0, 0.5])
+    parser.add_argument('--color', action='store_true', help="generate RGB pages instead of grayscale")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profiles', nargs='*', default=list(PROFILES), choices=list(PROFILES),
+                        help="encoder profiles to compare (default: all)")
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        case = json.loads(args.case)
+        result = run_case(args.work_dir, case['pages'], tuple(case['size']), case['png_ratio'],
+                          case['grayscale'], case['workers'], case['seed'], case['profiles'])
+        result['peak_rss_kb'] = peak_rss_kb()
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args.work_dir = args.work_dir or tmp
+        results = []
+        for pages in args.pages:
+            for size in args.sizes:
+                for png_ratio in args.png_ratio:
+                    case = {'pages': pages, 'size': size, 'png_ratio': png_ratio,
+                            'grayscale': not args.color, 'workers': args.workers, 'seed': args.seed,
+                            'profiles': args.profiles}
+                    result = run_isolated(args, case)
+                    results.append(result)
+                    print(f"{pages:>5} pages {size[0]}x{size[1]} png={png_ratio:.1f}: "
+                          f"extract {result['extract']['pages_per_s']:.1f} pages/s, "
+                          f"edges {result['compare']['edge_decode_ms_per_page']:.1f} ms/page, "
+                          f"encode {result['join']['encode_ms']:.1f} ms/spread, "
+                          f"peak RSS {result['peak_rss_kb']} KB")
+                    for profile, stats in result['encode'].items():
+                        if 'error' in stats:
+                            print(f"      {profile:<9} {stats['error']}")
+                        else:
+                            print(f"      {profile:<9} {stats['encode_ms_per_spread']:>7.1f} ms/spread "
+                                  f"{stats['bytes_per_spread'] / 1024:>8.1f} KB/spread")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
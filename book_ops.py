@@ -0,0 +1,140 @@
+import os
+import re
+import shutil
+import zipfile
+from xml.sax.saxutils import quoteattr, escape
+from metrics import metrics
+
+# 不依赖 Tk 的手动拼接和打包逻辑，GUI 和命令行共用；PIL 只在真正需要解码时才导入
+
+
+def extract_number(path):
+    filename = os.path.splitext(os.path.basename(path))[0]
+    number = re.sub(r'^0+', '', filename)
+    return int(number) if number.isdigit() else filename
+
+
+def page_sort_key(name):
+    # 按开头的页码排序，拼接出来的 12-13.jpg 排在第 12 页的位置；没有页码的排在最后
+    filename = os.path.splitext(os.path.basename(name))[0]
+    match = re.match(r'\d+', filename)
+    return (0, int(match.group()), filename) if match else (1, 0, filename)
+
+
+def stitched_filename(image_paths):
+    base_names = [extract_number(path) for path in image_paths]
+    base_names.sort()  # Sort numbers from small to large
+    return f"{'-'.join(map(str, base_names))}.jpg"
+
+
+def stitch_files(image_paths, profile=None):
+    # image_paths 按从左到右的顺序给出；结果写在第一张图所在目录，原图移到 Stitched/
+    # profile 为 encoder 里的 JPEG 编码配置，只在无法无损拼接时用到
+    from lossless_join import join_jpeg_files
+    from encoder import encode_image, require_jpeg
+    from manifest import write_atomic
+
+    require_jpeg(profile)
+    output_dir = os.path.dirname(image_paths[0])
+    output_path = os.path.join(output_dir, stitched_filename(image_paths))
+
+    # 两页参数一致时无损拼接，不再解码和重新编码
+    joined_data = join_jpeg_files(image_paths[0], image_paths[1]) if len(image_paths) == 2 else None
+    if joined_data is not None:
+        write_atomic(output_path, joined_data)
+    else:
+        from PIL import Image
+        from color_mode import output_mode
+
+        images = [Image.open(path) for path in image_paths]
+        mode = output_mode(*images)
+
+        total_width = sum(img.width for img in images)
+        max_height = max(img.height for img in images)
+
+        result_image = Image.new(mode, (total_width, max_height))
+
+        current_width = 0
+        for img in images:
+            result_image.paste(img, (current_width, 0))
+            current_width += img.width
+
+        with metrics.stage('encode', pair=os.path.basename(output_path), image_mode=mode, profile=profile):
+            encoded = encode_image(result_image, profile, sources=images, quality=95)
+            write_atomic(output_path, encoded)
+
+    stitched_dir = os.path.join(output_dir, "Stitched")
+    os.makedirs(stitched_dir, exist_ok=True)
+    for path in image_paths:
+        shutil.move(path, stitched_dir)
+    return output_path
+
+
+def pack_to_digital(output_dir, progress=None):
+    target_dir = os.path.join(output_dir, "digital")
+    os.makedirs(target_dir, exist_ok=True)
+
+    items = [item for item in os.listdir(output_dir) if os.path.join(output_dir, item) != target_dir]
+    for done, item in enumerate(items, 1):
+        shutil.move(os.path.join(output_dir, item), os.path.join(target_dir, item))
+        if progress:
+            progress(done, len(items))
+    return target_dir
+
+
+PAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.avif')
+
+
+def list_pages(directory):
+    names = [name for name in os.listdir(directory)
+             if name.lower().endswith(PAGE_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))]
+    return sorted(names, key=page_sort_key)
+
+
+def comic_info_xml(title, entries):
+    # ComicInfo 风格的页面索引；拼接出来的跨页（文件名带 "-"）标记为 DoublePage
+    pages = []
+    for index, (arcname, source_name, size) in enumerate(entries):
+        double = ' DoublePage="true"' if '-' in os.path.splitext(source_name)[0] else ''
+        pages.append(f'    <Page Image="{index}" ImageSize="{size}" Key={quoteattr(arcname)}{double} />')
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<ComicInfo xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            'xmlns:xsd="http://www.w3.org/2001/XMLSchema">\n'
+            f'  <Title>{escape(title)}</Title>\n'
+            f'  <PageCount>{len(entries)}</PageCount>\n'
+            '  <Pages>\n' + '\n'.join(pages) + '\n  </Pages>\n</ComicInfo>\n')
+
+
+def pack_to_cbz(output_dir, cbz_path=None, comic_info=True, remove_pages=False, progress=None, overwrite=True):
+    # 按页码顺序把页面直接流式写进 CBZ（ZIP_STORED，不重新压缩 JPEG），
+    # 先写临时文件再改名，内存占用与书的大小无关；overwrite 为 False 时不替换已有的同名文件
+    cbz_path = cbz_path or os.path.join(output_dir, "digital.cbz")
+    if not overwrite and os.path.exists(cbz_path):
+        raise FileExistsError(f"{cbz_path} already exists")
+    names = list_pages(output_dir)
+    width = max(4, len(str(len(names))))
+    tmp_path = cbz_path + '.tmp'
+
+    entries = []
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zf:
+            for done, name in enumerate(names, 1):
+                source_path = os.path.join(output_dir, name)
+                arcname = f"{done:0{width}d}{os.path.splitext(name)[1].lower()}"
+                zf.write(source_path, arcname)
+                entries.append((arcname, name, os.path.getsize(source_path)))
+                if progress:
+                    progress(done, len(names))
+            if comic_info:
+                title = os.path.splitext(os.path.basename(cbz_path))[0]
+                zf.writestr('ComicInfo.xml', comic_info_xml(title, entries), zipfile.ZIP_DEFLATED)
+        os.replace(tmp_path, cbz_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if remove_pages:
+        for name in names:
+            os.remove(os.path.join(output_dir, name))
+    return cbz_path
@@ -0,0 +1,30 @@
+# 选择页面的输出模式：灰度页和只用灰色的调色板页保持单通道 L，只有真正有颜色时才用 RGB。
+# 单通道的画布内存只有三分之一，编码更快，JPEG 也更小。
+
+GRAY_MODES = ('1', 'L', 'LA', 'I', 'I;16', 'F')
+
+# JPEG 压缩后的灰色像素色度会偏离中性值几个单位，不算彩色
+CHROMA_TOLERANCE = 8
+
+
+def is_grayscale(img, tolerance=CHROMA_TOLERANCE):
+    if img.mode in GRAY_MODES:
+        return True
+    if img.mode == 'P':
+        # 只看实际用到的调色板颜色，不展开整页
+        palette = img.getpalette()
+        for _, index in img.getcolors(256) or []:
+            rgb = palette[3 * index:3 * index + 3]
+            if rgb and max(rgb) - min(rgb) > tolerance:
+                return False
+        return True
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    _, cb, cr = img.convert('YCbCr').split()
+    (cb_low, cb_high), (cr_low, cr_high) = cb.getextrema(), cr.getextrema()
+    return max(128 - cb_low, cb_high - 128, 128 - cr_low, cr_high - 128) <= tolerance
+
+
+def output_mode(*images):
+    # 一对页只要有一边是彩色就整体用 RGB
+    return 'L' if all(is_grayscale(img) for img in images) else 'RGB'
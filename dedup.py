@@ -0,0 +1,178 @@
+import os
+import io
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+
+# 跨书共享的内容寻址存储：封面、空白页、出版社标志、章节分隔页在同一本书和整套书里反复出现，
+# 见过的内容直接硬链接已有的结果，不再转码、比较或拼接。
+# 设置这个环境变量（或命令行 --store）即可启用；不设置时行为与原来完全相同。
+ENV_VAR = 'KPS_STORE'
+
+INDEX_NAME = 'index.sqlite'
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def perceptual_hash(data, hash_size=16):
+    # dHash：缩成 (hash_size+1) x hash_size 的灰度图，比较相邻像素的明暗；JPEG 用 draft 低分辨率解码
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        size = img.size
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        line = pixels[row * (hash_size + 1):(row + 1) * (hash_size + 1)]
+        for left, right in zip(line, line[1:]):
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}", size
+
+
+def same_pixels(data, path, max_mse=4.0, max_diff=64):
+    # 感知哈希相同只说明整体明暗分布相同（白底上不同的章节标题哈希也一样），链接前逐像素比较：
+    # 重新编码带来的误差很小，内容不同的页至少有一处差别很大
+    from PIL import Image, ImageChops
+
+    with Image.open(io.BytesIO(data)) as img1, Image.open(path) as img2:
+        if img1.size != img2.size:
+            return False
+        histogram = ImageChops.difference(img1.convert('RGB'), img2.convert('RGB')).histogram()
+    counts = [sum(histogram[value::256]) for value in range(256)]
+    if any(counts[max_diff + 1:]):
+        return False
+    total = sum(counts)
+    return sum(count * value * value for value, count in enumerate(counts)) / total <= max_mse
+
+
+def link_or_copy(source, target):
+    # 同一文件系统上硬链接（不占额外空间），跨盘时退回复制
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+    return target
+
+
+class ContentStore:
+    # 页按 EPUB 条目的内容哈希（可选感知哈希）登记，分数和拼接按页面文件哈希登记，与清单用的键相同
+
+    def __init__(self, path):
+        self.path = path
+        self.objects_dir = os.path.join(path, 'objects')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        # batch 的多个工作进程共用同一个存储：WAL 让读写互不阻塞，写锁冲突时最多等一分钟，
+        # 而不是几秒后就报 database is locked
+        self.db = sqlite3.connect(os.path.join(path, INDEX_NAME), timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        # 早期的拼接表不区分编码配置，分数表不区分精确值和下界；都可以重新生成，直接丢掉重建
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(joins)')]
+        if columns and 'profile' not in columns:
+            self.db.execute('DROP TABLE joins')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(scores)')]
+        if columns and 'exact' not in columns:
+            self.db.execute('DROP TABLE scores')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                hash TEXT PRIMARY KEY, object TEXT, phash TEXT, width INTEGER, height INTEGER);
+            CREATE INDEX IF NOT EXISTS pages_phash ON pages (phash, width, height);
+            CREATE TABLE IF NOT EXISTS joins (
+                hash1 TEXT, hash2 TEXT, profile TEXT, object TEXT, PRIMARY KEY (hash1, hash2, profile));
+            CREATE TABLE IF NOT EXISTS scores (
+                hash1 TEXT, hash2 TEXT, edge_width INTEGER, metric TEXT, error REAL, exact INTEGER,
+                PRIMARY KEY (hash1, hash2, edge_width, metric));
+        """)
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def object_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key + '.jpg')
+
+    def add_object(self, key, path):
+        # 复制成存储私有的文件，不与输出目录里的文件共用 inode；先写临时文件再 os.link，
+        # 多个进程同时登记同一内容时只有一个成功，其余的直接用已有的对象
+        object_path = self.object_path(key)
+        if os.path.exists(object_path):
+            return object_path
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(object_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as target, open(path, 'rb') as source:
+                shutil.copyfileobj(source, target)
+            try:
+                os.link(tmp_path, object_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # 不支持硬链接的文件系统
+                os.replace(tmp_path, object_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return object_path
+
+    def existing(self, row):
+        # 对象文件被手动删掉时当作没有记录
+        return row[0] if row and os.path.exists(row[0]) else None
+
+    def lookup_page(self, entry_hash):
+        return self.existing(self.db.execute('SELECT object FROM pages WHERE hash = ?', (entry_hash,)).fetchone())
+
+    def lookup_similar_page(self, phash, size):
+        return self.existing(self.db.execute('SELECT object FROM pages WHERE phash = ? AND width = ? AND height = ?',
+                                             (phash, size[0], size[1])).fetchone())
+
+    def add_page(self, entry_hash, path, phash=None, size=None):
+        return self.link_page(entry_hash, self.add_object(entry_hash, path), phash, size)
+
+    def link_page(self, entry_hash, object_path, phash=None, size=None):
+        # 内容哈希指向已有的对象（感知哈希匹配且像素相同的页），下次直接按内容哈希找到
+        self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                        (entry_hash, object_path, phash, size[0] if size else None, size[1] if size else None))
+        self.db.commit()
+        return object_path
+
+    def lookup_join(self, hash1, hash2, profile=None):
+        # 无法无损拼接的跨页要重新编码，结果取决于编码配置
+        return self.existing(self.db.execute('SELECT object FROM joins WHERE hash1 = ? AND hash2 = ? AND profile = ?',
+                                             (hash1, hash2, profile or '')).fetchone())
+
+    def add_join(self, hash1, hash2, path, profile=None):
+        key = f'{hash1}-{hash2}-{profile}' if profile else f'{hash1}-{hash2}'
+        object_path = self.add_object(key, path)
+        self.db.execute('INSERT OR REPLACE INTO joins VALUES (?, ?, ?, ?)', (hash1, hash2, profile or '', object_path))
+        self.db.commit()
+        return object_path
+
+    def get_score(self, hash1, hash2, edge_width=5, metric='mse', exact=False):
+        # exact 为 True 时不返回提前淘汰时记下的下界
+        row = self.db.execute('SELECT error, exact FROM scores '
+                              'WHERE hash1 = ? AND hash2 = ? AND edge_width = ? AND metric = ?',
+                              (hash1, hash2, edge_width, metric)).fetchone()
+        return row[0] if row and (row[1] or not exact) else None
+
+    def put_scores(self, rows, edge_width=5, metric='mse', exact=True):
+        # 提前淘汰的页对记录的是不小于阈值的下界（exact=False），对配对结果来说与精确值等价；
+        # 下界不会覆盖已有的精确值
+        self.db.executemany('INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?) '
+                            'ON CONFLICT (hash1, hash2, edge_width, metric) DO UPDATE '
+                            'SET error = excluded.error, exact = excluded.exact WHERE excluded.exact >= scores.exact',
+                            [(hash1, hash2, edge_width, metric, error, int(exact)) for hash1, hash2, error in rows])
+        self.db.commit()
+
+
+def open_store(path=None):
+    # 没有给出路径也没有设置 KPS_STORE 时返回 None，调用方按不去重处理
+    path = path or os.environ.get(ENV_VAR)
+    return ContentStore(path) if path else None
@@ -0,0 +1,68 @@
+import io
+
+# 命名的编码配置。profile 为 None 时保持各调用点原来的设置（拼接用 PIL 默认质量，PNG 转码和手动拼接用 95）。
+# quality='keep' 沿用源 JPEG 的量化表和色度采样，源不是 JPEG 时退回 fallback_quality。
+PROFILES = {
+    'fast': {'format': 'JPEG', 'quality': 80, 'subsampling': '4:2:0', 'optimize': False, 'progressive': False},
+    'archival': {'format': 'JPEG', 'quality': 'keep', 'fallback_quality': 95, 'subsampling': '4:4:4',
+                 'optimize': True, 'progressive': False},
+    'small': {'format': 'JPEG', 'quality': 75, 'subsampling': '4:2:0', 'optimize': True, 'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60, 'speed': 6},
+}
+
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp', 'AVIF': '.avif'}
+
+
+def get_profile(profile):
+    if profile is None or isinstance(profile, dict):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown encoder profile {profile!r}, choose from {', '.join(PROFILES)}")
+    return PROFILES[profile]
+
+
+def profile_format(profile):
+    profile = get_profile(profile)
+    return profile['format'] if profile else 'JPEG'
+
+
+def extension(profile):
+    return EXTENSIONS[profile_format(profile)]
+
+
+def require_jpeg(profile):
+    # 解压和自动拼接的中间页必须是 .jpg（list_images、无损拼接都依赖它）；WebP/AVIF 只用于最终输出
+    if profile_format(profile) != 'JPEG':
+        raise ValueError(f"Profile {profile!r} writes {profile_format(profile)}; "
+                         "only JPEG profiles can be used for intermediate pages (use it with 'convert')")
+
+
+def save_options(profile, sources=(), quality=None):
+    profile = get_profile(profile)
+    if profile is None:
+        return {'format': 'JPEG', 'quality': quality} if quality is not None else {'format': 'JPEG'}
+
+    options = {key: value for key, value in profile.items() if key != 'fallback_quality'}
+    if options.get('quality') == 'keep':
+        source = next((img for img in sources if getattr(img, 'quantization', None)), None)
+        if source is None:
+            options['quality'] = profile.get('fallback_quality', 95)
+        else:
+            from PIL import JpegImagePlugin
+
+            # 新画布上不能直接用 'keep'，显式传入源文件的量化表和采样方式
+            del options['quality']
+            options['qtables'] = [table for _, table in sorted(source.quantization.items())]
+            sampling = JpegImagePlugin.get_sampling(source)
+            if sampling != -1:
+                options['subsampling'] = sampling
+    return options
+
+
+def encode_image(img, profile=None, sources=(), quality=None):
+    # sources 为拼接前的源图（用于 quality='keep'）；quality 是 profile 为 None 时的旧默认值
+    options = save_options(profile, sources, quality)
+    buffer = io.BytesIO()
+    img.save(buffer, **options)
+    return buffer.getvalue()
@@ -0,0 +1,206 @@
+import os
+import io
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from metrics import metrics
+from dedup import content_hash, perceptual_hash, same_pixels, link_or_copy
+from manifest import write_atomic
+from encoder import encode_image, require_jpeg
+from edge_index import build_index
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+
+
+def find_images_folders(file_list):
+    return ['images/'] + [f'{name}images/' for name in file_list if name.endswith('_files/')]
+
+
+def index_epub_images(zip_ref):
+    # 只遍历一次条目列表，按图片文件夹分组，保持原来"先文件夹后条目"的顺序
+    infos = zip_ref.infolist()
+    images_folders = find_images_folders([info.filename for info in infos])
+    folder_set = set(images_folders)
+    grouped = {folder: [] for folder in images_folders}
+
+    for file_info in infos:
+        name = file_info.filename
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        start = name.find('images/')
+        while start != -1:
+            folder = name[:start + len('images/')]
+            if folder in folder_set:
+                grouped[folder].append(file_info)
+            start = name.find('images/', start + 1)
+
+    return [(folder, file_info) for folder in images_folders for file_info in grouped[folder]]
+
+
+def output_filename(file_info, images_folder):
+    original_filename = file_info.filename.replace(images_folder, '')
+    new_filename = original_filename.lstrip('0') or '0'
+    return os.path.splitext(new_filename)[0] + '.jpg'
+
+
+def transcode_png(data, new_filepath, profile=None):
+    from PIL import Image  # 只有 PNG 页需要解码，纯 JPEG 的书不用加载 PIL
+    from color_mode import output_mode
+
+    page = os.path.basename(new_filepath)
+    with metrics.stage('extract', page=page, format='png'):
+        with Image.open(io.BytesIO(data)) as img:
+            # 灰度和灰色调色板的 PNG 保持单通道，不再一律转成 RGB
+            mode = output_mode(img)
+            page_img = img.convert(mode)
+    with metrics.stage('encode', page=page, image_mode=mode, profile=profile):
+        encoded = encode_image(page_img, profile, quality=95)
+        write_atomic(new_filepath, encoded)
+    return new_filepath
+
+
+def is_png(file_info):
+    return file_info.filename.lower().endswith('.png')
+
+
+def store_key(data, file_info, profile=None):
+    # 转码出来的页取决于编码配置，所以 PNG 的键里带上配置名；JPEG 原样写出，与配置无关
+    entry_hash = content_hash(data)
+    return f"{entry_hash}-{profile}" if profile and is_png(file_info) else entry_hash
+
+
+def write_page(file_info, data, new_filepath, profile=None):
+    if is_png(file_info):
+        return transcode_png(data, new_filepath, profile)
+    with metrics.stage('extract', page=os.path.basename(new_filepath), format='jpeg'):
+        write_atomic(new_filepath, data)
+    return new_filepath
+
+
+def reuse_page(store, data, file_info, new_filepath, perceptual=False, profile=None):
+    # 内容见过时硬链接已有的结果并返回 None；否则返回登记用的 (内容哈希, 感知哈希和尺寸)
+    with metrics.stage('dedup', page=os.path.basename(new_filepath)):
+        entry_hash = store_key(data, file_info, profile)
+        object_path = store.lookup_page(entry_hash)
+        similar = None
+        if object_path is None and perceptual:
+            similar = perceptual_hash(data)
+            object_path = store.lookup_similar_page(*similar)
+            if object_path is not None:
+                if same_pixels(data, object_path):
+                    store.link_page(entry_hash, object_path, *similar)
+                else:
+                    object_path = None
+        if object_path is not None:
+            link_or_copy(object_path, new_filepath)
+            return None
+    return entry_hash, similar
+
+
+def process_image(zip_ref, file_info, images_folder, output_dir, store=None, perceptual=False, profile=None):
+    new_filepath = os.path.join(output_dir, output_filename(file_info, images_folder))
+    os.makedirs(os.path.dirname(new_filepath), exist_ok=True)
+
+    if store is not None:
+        data = zip_ref.read(file_info)
+        key = reuse_page(store, data, file_info, new_filepath, perceptual, profile)
+        if key is not None:
+            write_page(file_info, data, new_filepath, profile)
+            store.add_page(key[0], new_filepath, *(key[1] or ()))
+        return new_filepath
+
+    if is_png(file_info):
+        transcode_png(zip_ref.read(file_info), new_filepath, profile)
+    else:
+        # JPEG 原样写出，不解码；先写临时文件再改名，目标是指向共享存储的硬链接时也不会改写存储里的对象
+        tmp_path = new_filepath + '.tmp'
+        with metrics.stage('extract', page=os.path.basename(new_filepath), format='jpeg'), \
+                zip_ref.open(file_info) as source, open(tmp_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(tmp_path, new_filepath)
+    return new_filepath
+
+
+def extract_epub(epub_file, output_dir, workers=None, progress=None, store=None, perceptual=False, profile=None,
+                 edge_index=True):
+    # 直接从 EPUB 读取（EPUB 本身就是 zip），不再复制成 .zip
+    # progress(done, total) 每写完一页调用一次
+    # store 为 dedup.ContentStore 时，内容见过的页（本书或以前的书）硬链接已有的结果，不再写出或转码
+    # profile 为 encoder 里的 JPEG 编码配置，只影响需要转码的 PNG 页
+    # edge_index 为 True 时顺便写出边缘索引（edge_index.py），自动拼接时不用再打开每一页
+    require_jpeg(profile)
+    written = []
+    keys = {}       # 转码任务 -> 登记用的哈希
+    in_flight = {}  # 正在转码的内容哈希 -> 内容相同、等它完成后再链接的页
+
+    def page_done(paths):
+        written.extend(paths)
+        if progress:
+            progress(len(written), len(entries))
+
+    def png_done(future):
+        new_filepath = future.result()
+        key = keys.pop(future)
+        paths = [new_filepath]
+        if key is not None:
+            store.add_page(key[0], new_filepath, *(key[1] or ()))
+            paths += [link_or_copy(new_filepath, path) for path in in_flight.pop(key[0])]
+        page_done(paths)
+
+    with zipfile.ZipFile(epub_file, 'r') as zip_ref:
+        entries = index_epub_images(zip_ref)
+        png_entries = [(folder, info) for folder, info in entries if is_png(info)]
+
+        if len(png_entries) < 2 or workers == 1:
+            for images_folder, file_info in entries:
+                page_done([process_image(zip_ref, file_info, images_folder, output_dir, store, perceptual, profile)])
+            if edge_index:
+                index_pages(output_dir, written, workers)
+            return written
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for images_folder, file_info in entries:
+                if not is_png(file_info):
+                    page_done([process_image(zip_ref, file_info, images_folder, output_dir, store, perceptual,
+                                             profile)])
+                    continue
+
+                # 限制排队中的 PNG 数量，避免整本书的字节都堆在内存里
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        png_done(future)
+
+                new_filepath = os.path.join(output_dir, output_filename(file_info, images_folder))
+                os.makedirs(os.path.dirname(new_filepath), exist_ok=True)
+                data = zip_ref.read(file_info)
+                key = None
+                if store is not None:
+                    key = reuse_page(store, data, file_info, new_filepath, perceptual, profile)
+                    if key is None:
+                        page_done([new_filepath])
+                        continue
+                    if key[0] in in_flight:
+                        in_flight[key[0]].append(new_filepath)
+                        continue
+                    in_flight[key[0]] = []
+                future = pool.submit(transcode_png, data, new_filepath, profile)
+                keys[future] = key
+                pending.add(future)
+            for future in pending:
+                png_done(future)
+            if edge_index:
+                index_pages(output_dir, written, workers, pool)
+    return written
+
+
+def index_pages(output_dir, paths, workers=None, pool=None):
+    # 从写出的文件取边缘（PNG 页取的是转码后的 JPEG，分数与不用索引时完全相同）；
+    # 纯 JPEG 的书走串行解压，取边缘时另开进程池
+    with metrics.stage('index', pages=len(paths)):
+        if pool is not None or workers == 1 or len(paths) < 2:
+            return build_index(output_dir, paths, pool)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            return build_index(output_dir, paths, pool)
@@ -0,0 +1,228 @@
+import os
+import tkinter as tk
+from tkinter import ttk, messagebox
+from book_ops import page_sort_key, stitch_files
+from preview import ThumbnailCache
+from edge_index import EdgeIndex, strip_mse
+from pairing import choose_pairs
+
+CELL_WIDTH = 130
+CELL_HEIGHT = 200
+THUMB_SIZE = (120, 170)
+PAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SUGGEST_THRESHOLD = 50  # 与自动拼接的 MSE 阈值相同
+
+
+class GalleryWindow(tk.Toplevel):
+    # 整个目录的页面图库：只为屏幕上的行创建画布项，缩略图在后台按需解码，上千页的目录也不卡
+
+    def __init__(self, master, directory, runner, desc_order):
+        super().__init__(master)
+        self.title(f"Gallery - {directory}")
+        self.geometry("700x800")
+        self.directory = directory
+        self.runner = runner
+        self.desc_order = desc_order
+        self.thumbnails = ThumbnailCache(self, size=THUMB_SIZE, capacity=300, workers=4)
+        self.pages = []
+        self.items = {}     # 页下标 -> (边框, 图片, 文字, PhotoImage)
+        self.marks = {}     # 页下标 -> 配对 (i, j)
+        self.selected = None
+        self.columns = 1
+        self.create_widgets()
+        self.refresh()
+
+    def create_widgets(self):
+        body = ttk.Frame(self)
+        body.pack(fill="both", expand=True)
+
+        self.canvas = tk.Canvas(body, background='#E0E0E0', highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self.on_scroll)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.scrollbar.pack(side=tk.RIGHT, fill="y")
+        self.canvas.pack(side=tk.LEFT, fill="both", expand=True)
+
+        bar = ttk.Frame(self)
+        bar.pack(fill="x", pady=5)
+        self.status_label = ttk.Label(bar, text="")
+        self.status_label.pack(side=tk.LEFT, padx=10)
+        ttk.Button(bar, text="Refresh", command=self.refresh).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(bar, text="Clear marks", command=self.clear_marks).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(bar, text="Suggest pairs", command=self.suggest_pairs).pack(side=tk.RIGHT, padx=5)
+        self.stitch_button = ttk.Button(bar, text="Stitch marked", style='ButtonNo2.TButton',
+                                        command=self.stitch_marked)
+        self.stitch_button.pack(side=tk.RIGHT, padx=5)
+
+        self.canvas.bind('<Configure>', lambda event: self.relayout())
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<MouseWheel>', lambda event: self.scroll_units(-1 if event.delta > 0 else 1))
+        self.canvas.bind('<Button-4>', lambda event: self.scroll_units(-1))
+        self.canvas.bind('<Button-5>', lambda event: self.scroll_units(1))
+
+    def refresh(self):
+        # 只列目录，不解码任何图片；先按旧的页列表清掉格子，排队中的旧页缩略图才会被取消
+        self.clear_items()
+        names = [name for name in os.listdir(self.directory) if name.lower().endswith(PAGE_EXTENSIONS)]
+        self.pages = [os.path.join(self.directory, name) for name in sorted(names, key=page_sort_key)]
+        self.marks = {}
+        self.selected = None
+        self.relayout()
+
+    def clear_items(self):
+        for index in list(self.items):
+            self.drop_item(index)
+
+    def relayout(self):
+        width = max(self.canvas.winfo_width(), CELL_WIDTH)
+        columns = max(1, width // CELL_WIDTH)
+        if columns != self.columns:
+            self.columns = columns
+            self.clear_items()
+        rows = (len(self.pages) + self.columns - 1) // self.columns
+        self.canvas.configure(scrollregion=(0, 0, self.columns * CELL_WIDTH, rows * CELL_HEIGHT))
+        self.render()
+
+    def on_scroll(self, *args):
+        self.canvas.yview(*args)
+        self.render()
+
+    def scroll_units(self, units):
+        self.canvas.yview_scroll(units, 'units')
+        self.render()
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first_row = max(0, int(top // CELL_HEIGHT))
+        last_row = int(bottom // CELL_HEIGHT)
+        return range(first_row * self.columns, min(len(self.pages), (last_row + 1) * self.columns))
+
+    def render(self):
+        visible = self.visible_range()
+        for index in list(self.items):
+            if index not in visible:
+                self.drop_item(index)
+        for index in visible:
+            if index not in self.items:
+                self.create_item(index)
+        self.update_status()
+
+    def create_item(self, index):
+        path = self.pages[index]
+        row, column = divmod(index, self.columns)
+        x, y = column * CELL_WIDTH, row * CELL_HEIGHT
+        rect = self.canvas.create_rectangle(x + 3, y + 3, x + CELL_WIDTH - 3, y + CELL_HEIGHT - 3,
+                                            outline=self.outline_color(index), width=3)
+        image = self.canvas.create_image(x + CELL_WIDTH // 2, y + 8 + THUMB_SIZE[1] // 2)
+        text = self.canvas.create_text(x + CELL_WIDTH // 2, y + CELL_HEIGHT - 14, text=os.path.basename(path))
+        self.items[index] = [rect, image, text, None]
+        self.thumbnails.get(path, lambda photo, index=index, path=path: self.set_thumbnail(index, path, photo))
+
+    def drop_item(self, index):
+        rect, image, text, _ = self.items.pop(index)
+        self.canvas.delete(rect, image, text)
+        if index < len(self.pages):
+            self.thumbnails.cancel(self.pages[index])
+
+    def set_thumbnail(self, index, path, photo):
+        item = self.items.get(index)
+        if item is None or self.pages[index] != path:
+            return
+        self.canvas.itemconfig(item[1], image=photo)
+        item[3] = photo  # 保持引用，缓存淘汰后仍能显示
+
+    def outline_color(self, index):
+        if index == self.selected:
+            return '#FFA500'
+        if index in self.marks:
+            return '#81001E'
+        return '#E0E0E0'
+
+    def update_outlines(self, *indices):
+        for index in indices:
+            if index is not None and index in self.items:
+                self.canvas.itemconfig(self.items[index][0], outline=self.outline_color(index))
+
+    def on_click(self, event):
+        column = int(self.canvas.canvasx(event.x) // CELL_WIDTH)
+        index = int(self.canvas.canvasy(event.y) // CELL_HEIGHT) * self.columns + column
+        if column >= self.columns or not 0 <= index < len(self.pages):
+            return
+
+        # 点击已标记的页取消整对；否则先选一页，再点另一页组成一对
+        if index in self.marks:
+            first, second = self.marks[index]
+            del self.marks[first], self.marks[second]
+            self.update_outlines(first, second)
+        elif self.selected is None:
+            self.selected = index
+            self.update_outlines(index)
+        elif self.selected == index:
+            self.selected = None
+            self.update_outlines(index)
+        else:
+            pair = (self.selected, index)
+            self.marks[pair[0]] = self.marks[pair[1]] = pair
+            self.selected = None
+            self.update_outlines(*pair)
+        self.update_status()
+
+    def clear_marks(self):
+        previous = list(self.marks) + [self.selected]
+        self.marks = {}
+        self.selected = None
+        self.update_outlines(*previous)
+        self.update_status()
+
+    def suggest_pairs(self):
+        # 用解压时写下的边缘索引给相邻页打分并标记，不打开任何图片；已有的标记和选中的页保持不变
+        index = EdgeIndex.load(self.directory)
+        records = [index.get(os.path.relpath(path, self.directory)) for path in self.pages]
+        if not any(records):
+            messagebox.showinfo("Gallery", "No edge index for this folder. Extract the EPUB again to create one.",
+                                parent=self)
+            return
+        errors = [suggested_error(records[i], records[i + 1], self.desc_order.get())
+                  for i in range(len(self.pages) - 1)]
+        for i in choose_pairs(errors, SUGGEST_THRESHOLD):
+            if i in self.marks or i + 1 in self.marks or self.selected in (i, i + 1):
+                continue
+            self.marks[i] = self.marks[i + 1] = (i, i + 1)
+            self.update_outlines(i, i + 1)
+        self.update_status()
+
+    def marked_pairs(self):
+        pairs = sorted(set(self.marks.values()))
+        # 与主窗口一致：按页码排序，"Right to Left" 时页码大的在左
+        return [sorted((self.pages[i], self.pages[j]), key=page_sort_key, reverse=self.desc_order.get())
+                for i, j in pairs]
+
+    def update_status(self):
+        self.status_label.config(text=f"{len(self.pages)} pages, {len(self.marks) // 2} pairs marked")
+
+    def stitch_marked(self):
+        pairs = self.marked_pairs()
+        if not pairs:
+            messagebox.showinfo("Gallery", "Click two pages to mark a pair first.", parent=self)
+            return
+        job = self.runner.submit(f"Stitch {len(pairs)} pairs", run_stitch_pairs, pairs)
+        job.on_finish = lambda kind, payload: self.refresh() if self.winfo_exists() else None
+        self.clear_marks()
+
+
+def suggested_error(record1, record2, right_to_left):
+    # "Right to Left" 时后一页在左，与自动拼接相同：比较前一页的左边缘和后一页的右边缘；否则反过来
+    if not (record1 and record2):
+        return float('inf')
+    if right_to_left:
+        return strip_mse((record1['left'], record1['size'][1]), (record2['right'], record2['size'][1]))
+    return strip_mse((record1['right'], record1['size'][1]), (record2['left'], record2['size'][1]))
+
+
+def run_stitch_pairs(job, pairs):
+    outputs = []
+    for done, paths in enumerate(pairs, 1):
+        if all(os.path.exists(path) for path in paths):
+            outputs.append(stitch_files(paths))
+        job.report(done, len(pairs))
+    return outputs
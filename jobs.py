@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, name, func, args, kwargs):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancel_event = threading.Event()
+        self.started = None
+        self.done = 0
+        self.total = 0
+        self.on_finish = None  # 任务结束（完成/取消/失败）后在 Tk 线程调用
+        self._events = None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report(self, done, total):
+        # 每处理完一页调用一次，取消只在页与页之间生效
+        self.done, self.total = done, total
+        self._events.put(('progress', self, None))
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    @property
+    def rate(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        rate = self.rate
+        return (self.total - self.done) / rate if rate > 0 and self.total else None
+
+
+class JobRunner:
+    # 在一个工作线程上依次运行任务，通过 after() 把结果交回 Tk 线程
+
+    def __init__(self, widget, on_event, poll_ms=100):
+        self.widget = widget
+        self.on_event = on_event
+        self.poll_ms = poll_ms
+        self.jobs = queue.Queue()
+        self.events = queue.Queue()
+        self.current = None
+        self.pending = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.widget.after(self.poll_ms, self._poll)
+
+    def submit(self, name, func, *args, **kwargs):
+        # func 的第一个参数是 Job，用 job.report(done, total) 汇报进度
+        job = Job(name, func, args, kwargs)
+        job._events = self.events
+        self.pending += 1
+        self.jobs.put(job)
+        self.events.put(('queued', job, None))
+        return job
+
+    def cancel(self):
+        job = self.current
+        if job is not None:
+            job.cancel()
+
+    @property
+    def busy(self):
+        return self.pending > 0
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            self.current = job
+            job.started = time.perf_counter()
+            self.events.put(('started', job, None))
+            try:
+                result = job.func(job, *job.args, **job.kwargs)
+                self.events.put(('finished', job, result))
+            except JobCancelled:
+                self.events.put(('cancelled', job, None))
+            except Exception as e:
+                self.events.put(('failed', job, e))
+            finally:
+                self.current = None
+
+    def _poll(self):
+        try:
+            while True:
+                kind, job, payload = self.events.get_nowait()
+                if kind in ('finished', 'cancelled', 'failed'):
+                    self.pending -= 1
+                self.on_event(kind, job, payload)
+                if kind in ('finished', 'cancelled', 'failed') and job.on_finish:
+                    job.on_finish(kind, payload)
+        except queue.Empty:
+            pass
+        self.widget.after(self.poll_ms, self._poll)
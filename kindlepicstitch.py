@@ -0,0 +1,210 @@
+import os
+import sys
+import argparse
+from encoder import PROFILES
+
+# 命令行入口，不加载 Tk；PIL/numpy 等只在对应子命令里导入
+
+DEFAULT_OUTPUT_DIR = os.environ.get('KPS_OUTPUT_DIR', r"D:\FFOutput")
+
+# encoder 只依赖标准库，导入它不影响启动时间；WebP/AVIF 只能用于 convert 的最终输出
+JPEG_PROFILES = [name for name, profile in PROFILES.items() if profile['format'] == 'JPEG']
+
+
+def cmd_extract(args):
+    from epub_extract import extract_epub
+
+    from dedup import open_store
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    store = open_store(args.store)
+    try:
+        for epub_file in args.epub:
+            written = extract_epub(epub_file, args.output_dir, workers=args.workers, store=store,
+                                   perceptual=args.perceptual, profile=args.profile, edge_index=args.edge_index)
+            print(f"{epub_file}: {len(written)} pages -> {args.output_dir}")
+    finally:
+        if store:
+            store.close()
+
+
+def cmd_autostitch(args):
+    from ImgStitchAuto import process_images
+    from dedup import open_store
+
+    input_dir = args.input_dir or args.output_dir
+    stitched_dir = args.stitched_dir or os.path.join(input_dir, "Stitched")
+    store = open_store(args.store)
+    try:
+        process_images(input_dir, stitched_dir, args.workers, args.pairing, use_manifest=args.use_manifest,
+                       metric=args.similarity, store=store, profile=args.profile)
+    finally:
+        if store:
+            store.close()
+
+
+def cmd_stitch(args):
+    from book_ops import stitch_files, extract_number
+
+    # 默认右到左：页码大的在左边，与 GUI 的 "Right to Left" 一致
+    paths = sorted(args.images, key=extract_number, reverse=not args.left_to_right)
+    print(stitch_files(paths, args.profile))
+
+
+def cmd_pack(args):
+    from book_ops import pack_to_digital, pack_to_cbz
+
+    if args.cbz is None:
+        print(pack_to_digital(args.output_dir))
+    else:
+        print(pack_to_cbz(args.output_dir, args.cbz or None, comic_info=args.comic_info, remove_pages=args.remove_pages))
+
+
+def cmd_convert(args):
+    from pipeline import convert_epub, DirectoryWriter, CbzWriter
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for epub_file in args.epub:
+        title = os.path.splitext(os.path.basename(epub_file))[0]
+        if args.cbz:
+            writer = CbzWriter(os.path.join(args.output_dir, f"{title}.cbz"), comic_info=args.comic_info)
+        else:
+            writer = DirectoryWriter(os.path.join(args.output_dir, title))
+        print(f"{epub_file} -> {convert_epub(epub_file, writer, args.similarity, queue_size=args.queue_size, profile=args.profile)}")
+
+
+def cmd_watch(args):
+    from watch import Watcher
+
+    Watcher(args.inbox, args.output_dir, settle=args.settle, poll=args.poll, interval=args.interval,
+            workers=args.workers, pairing=args.pairing, metric=args.similarity, store_path=args.store,
+            status_path=args.status, status_port=args.status_port).run()
+
+
+def cmd_batch(args):
+    from batch import JobQueue, QUEUE_NAME, find_epubs, run_batch, print_report
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    queue_path = args.queue or os.path.join(args.output_dir, QUEUE_NAME)
+    queue = JobQueue(queue_path)
+    try:
+        if args.retry_failed:
+            print(f"Requeued {queue.retry_failed()} failed book(s)")
+        if args.epub:
+            print(f"Queued {queue.add(find_epubs(args.epub), os.path.abspath(args.output_dir))} new book(s)")
+    finally:
+        queue.close()
+
+    if not args.status:
+        options = {'pairing': args.pairing, 'metric': args.similarity, 'profile': args.profile, 'pack': args.pack,
+                   'store': args.store, 'lease': args.lease, 'stall': args.stall_timeout,
+                   'max_attempts': args.max_attempts}
+        run_batch(queue_path, args.processes, options)
+    print_report(queue_path)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='kindlepicstitch', description="Headless EPUB extraction and page stitching")
+    parser.add_argument('-o', '--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help="page directory (default: $KPS_OUTPUT_DIR or D:\\FFOutput)")
+    parser.add_argument('--metrics', metavar='PATH', help="record per-stage timings to PATH (.jsonl or .csv)")
+    parser.add_argument('--store', metavar='DIR',
+                        help="shared content store that lets extract/autostitch skip pages and pairs seen in "
+                             "other books (default: $KPS_STORE)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    extract = subparsers.add_parser('extract', help="extract page images from EPUB files")
+    extract.add_argument('epub', nargs='+')
+    extract.add_argument('--workers', type=int, default=None, help="processes for PNG transcoding")
+    extract.add_argument('--perceptual', action='store_true',
+                         help="with a store, also reuse re-encoded copies of stored pages "
+                         "(perceptual hash, confirmed pixel by pixel)")
+    extract.add_argument('--profile', choices=JPEG_PROFILES, help="encoder profile for transcoded PNG pages")
+    extract.add_argument('--no-edge-index', dest='edge_index', action='store_false',
+                         help="do not write the edge index that lets autostitch skip decoding every page")
+    extract.set_defaults(func=cmd_extract)
+
+    autostitch = subparsers.add_parser('autostitch', help="find and join two-page spreads")
+    autostitch.add_argument('input_dir', nargs='?', help="defaults to --output-dir")
+    autostitch.add_argument('stitched_dir', nargs='?', help="defaults to INPUT_DIR/Stitched")
+    autostitch.add_argument('--workers', type=int, default=1)
+    autostitch.add_argument('--pairing', choices=['optimal', 'stride'], default='optimal')
+    autostitch.add_argument('--no-manifest', dest='use_manifest', action='store_false')
+    autostitch.add_argument('--similarity', choices=['mse', 'ncc', 'gradient'], default='mse')
+    autostitch.add_argument('--profile', choices=JPEG_PROFILES,
+                            help="encoder profile for spreads that cannot be joined losslessly")
+    autostitch.set_defaults(func=cmd_autostitch)
+
+    stitch = subparsers.add_parser('stitch', help="join two given pages")
+    stitch.add_argument('images', nargs=2)
+    stitch.add_argument('--left-to-right', action='store_true', help="put the lower page number on the left")
+    stitch.add_argument('--profile', choices=JPEG_PROFILES, help="encoder profile if the pages must be re-encoded")
+    stitch.set_defaults(func=cmd_stitch)
+
+    convert = subparsers.add_parser('convert', help="EPUB straight to stitched pages in memory, without intermediate files")
+    convert.add_argument('epub', nargs='+')
+    convert.add_argument('--cbz', action='store_true', help="write OUTPUT_DIR/<book>.cbz instead of OUTPUT_DIR/<book>/")
+    convert.add_argument('--no-comic-info', dest='comic_info', action='store_false')
+    convert.add_argument('--similarity', choices=['mse', 'ncc', 'gradient'], default='mse')
+    convert.add_argument('--queue-size', type=int, default=4, help="pages buffered between stages")
+    convert.add_argument('--profile', choices=list(PROFILES),
+                         help="encoder profile; webp/avif re-encode every page (default: keep JPEG pages as they are)")
+    convert.set_defaults(func=cmd_convert)
+
+    watch = subparsers.add_parser('watch', help="keep extracting and auto-stitching whatever lands in INBOX")
+    watch.add_argument('inbox', help="EPUBs are extracted into OUTPUT_DIR/<book>/, page folders are stitched in place")
+    watch.add_argument('--settle', type=float, default=2.0, help="seconds a file must stay unchanged (default 2)")
+    watch.add_argument('--poll', action='store_true', help="poll the directory instead of using inotify")
+    watch.add_argument('--interval', type=float, default=1.0, help="polling interval in seconds")
+    watch.add_argument('--workers', type=int, default=1)
+    watch.add_argument('--pairing', choices=['optimal', 'stride'], default='optimal')
+    watch.add_argument('--similarity', choices=['mse', 'ncc', 'gradient'], default='mse')
+    watch.add_argument('--status', metavar='PATH', help="status JSON file (default: OUTPUT_DIR/watch-status.json)")
+    watch.add_argument('--status-port', type=int, help="also serve the status as JSON on http://127.0.0.1:PORT/")
+    watch.set_defaults(func=cmd_watch)
+
+    batch = subparsers.add_parser('batch', help="queue many EPUBs and process them with a pool of worker processes")
+    batch.add_argument('epub', nargs='*', help="EPUB files or directories to add; each book gets OUTPUT_DIR/<book>/")
+    batch.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                       help="worker processes, one book each (default: CPU count)")
+    batch.add_argument('--queue', metavar='PATH', help="queue database (default: OUTPUT_DIR/.kindlepicstitch-queue.sqlite)")
+    batch.add_argument('--pack', choices=['cbz', 'digital', 'none'], default='cbz',
+                       help="after stitching, write <book>.cbz or move the pages into digital/ (default: cbz)")
+    batch.add_argument('--pairing', choices=['optimal', 'stride'], default='optimal')
+    batch.add_argument('--similarity', choices=['mse', 'ncc', 'gradient'], default='mse')
+    batch.add_argument('--profile', choices=JPEG_PROFILES,
+                       help="encoder profile for transcoded PNG pages and re-encoded spreads")
+    batch.add_argument('--lease', type=float, default=300.0,
+                       help="seconds before a book held by a crashed or stuck worker is retried (default 300)")
+    batch.add_argument('--stall-timeout', type=float, default=900.0,
+                       help="seconds without progress (a page or a stage finished) before a worker counts as stuck "
+                            "(default 900)")
+    batch.add_argument('--max-attempts', type=int, default=3, help="attempts per book before it is marked failed")
+    batch.add_argument('--retry-failed', action='store_true', help="requeue books that failed in an earlier run")
+    batch.add_argument('--status', action='store_true', help="only print the per-book report, do not process")
+    batch.set_defaults(func=cmd_batch)
+
+    pack = subparsers.add_parser('pack', help="move everything in --output-dir into digital/, or write a CBZ")
+    pack.add_argument('--cbz', nargs='?', const='', metavar='PATH',
+                      help="stream the pages into a CBZ instead (default PATH: OUTPUT_DIR/digital.cbz)")
+    pack.add_argument('--no-comic-info', dest='comic_info', action='store_false',
+                      help="do not add a ComicInfo.xml page index")
+    pack.add_argument('--remove-pages', action='store_true', help="delete the packed pages after the CBZ is written")
+    pack.set_defaults(func=cmd_pack)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics:
+        from metrics import metrics
+        metrics.enable(args.metrics)
+    args.func(args)
+    if args.metrics:
+        metrics.finish()
+
+
+if __name__ == "__main__":
+    from multiprocessing import freeze_support
+    freeze_support()
+    sys.exit(main())
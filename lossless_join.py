@@ -0,0 +1,78 @@
+import io
+import os
+import shutil
+import tempfile
+import subprocess
+from PIL import Image
+
+# 需要支持 -crop 扩展画布和 -drop 的 jpegtran（libjpeg-turbo 2.1+ 或 IJG libjpeg 9+）
+JPEGTRAN = shutil.which('jpegtran')
+
+
+def jpeg_layout(fp):
+    # 返回决定能否在 DCT 域直接拼接的参数；不是基线 JPEG 时返回 None
+    with Image.open(fp) as img:
+        if img.format != 'JPEG' or img.info.get('progressive') or img.info.get('progression'):
+            return None
+        sampling = tuple((h, v, tq) for _, h, v, tq in img.layer)
+        tables = tuple((key, tuple(table)) for key, table in sorted(img.quantization.items()))
+        mcu_width = 8 * max(h for h, _, _ in sampling)
+        return img.size, img.mode, sampling, tables, mcu_width
+
+
+def can_join_losslessly(left, right):
+    # left/right 为 jpeg_layout 的结果：高度、色彩、采样因子、量化表一致，且左页宽度按 MCU 对齐
+    if JPEGTRAN is None or left is None or right is None:
+        return False
+    (left_width, left_height), left_mode, left_sampling, left_tables, mcu_width = left
+    (_, right_height), right_mode, right_sampling, right_tables, _ = right
+    return (left_height == right_height and left_mode == right_mode
+            and left_sampling == right_sampling and left_tables == right_tables
+            and left_width % mcu_width == 0)
+
+
+def join_jpeg_files(left_path, right_path, left_layout=None, right_layout=None):
+    # 用 jpegtran 扩展左页画布再把右页的 DCT 系数块放进去，不回到像素，也不重新编码。
+    # 不满足条件或 jpegtran 失败时返回 None，由调用方走原来的解码/拼接/编码路径。
+    left_layout = left_layout or jpeg_layout(left_path)
+    right_layout = right_layout or jpeg_layout(right_path)
+    if not can_join_losslessly(left_layout, right_layout):
+        return None
+
+    return run_jpegtran(left_layout, right_layout, right_path, left_path=left_path)
+
+
+def join_jpeg_bytes(left_data, right_data):
+    # 内存中的两页：左页从 stdin 传给 jpegtran，右页（-drop 只接受文件名）写一个临时文件
+    left_layout = jpeg_layout(io.BytesIO(left_data))
+    right_layout = jpeg_layout(io.BytesIO(right_data))
+    if not can_join_losslessly(left_layout, right_layout):
+        return None
+
+    fd, right_path = tempfile.mkstemp(suffix='.jpg')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(right_data)
+        return run_jpegtran(left_layout, right_layout, right_path, left_data=left_data)
+    finally:
+        os.remove(right_path)
+
+
+def run_jpegtran(left_layout, right_layout, right_path, left_path=None, left_data=None):
+    (left_width, height) = left_layout[0]
+    total_width = left_width + right_layout[0][0]
+    args = [JPEGTRAN, '-crop', f'{total_width}x{height}+0+0', '-drop', f'+{left_width}+0', right_path]
+    try:
+        result = subprocess.run(args + ([left_path] if left_path else []), input=left_data,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    # 旧版 jpegtran 不支持扩展画布时会输出错误尺寸，这种情况也回退
+    try:
+        with Image.open(io.BytesIO(result.stdout)) as joined:
+            if joined.size != (total_width, height):
+                return None
+    except OSError:
+        return None
+    return result.stdout
@@ -0,0 +1,133 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+from metrics import metrics
+
+MANIFEST_NAME = '.kindlepicstitch.sqlite'
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    # 每个输出目录一份：页面哈希、边缘分数和拼接日志（started -> joined -> done，中断后由 resume 做完）
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        # 旧版的分数表没有 metric 列或不区分精确值和下界；分数只是缓存，直接丢掉重建
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(scores)')]
+        if columns and not {'metric', 'exact'} <= set(columns):
+            self.db.execute('DROP TABLE scores')
+        # 旧版的日志不记页面哈希，无法确认中断的页对还是同样的两页，丢掉后按新页处理
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(journal)')]
+        if columns and 'hash1' not in columns:
+            self.db.execute('DROP TABLE journal')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT);
+            CREATE TABLE IF NOT EXISTS scores (
+                hash1 TEXT, hash2 TEXT, edge_width INTEGER, metric TEXT, error REAL, exact INTEGER,
+                PRIMARY KEY (hash1, hash2, edge_width, metric));
+            CREATE TABLE IF NOT EXISTS journal (
+                name1 TEXT, name2 TEXT, output TEXT, error REAL, state TEXT, hash1 TEXT, hash2 TEXT,
+                PRIMARY KEY (name1, name2));
+        """)
+        self.db.commit()
+
+    @classmethod
+    def open(cls, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        return cls(os.path.join(output_dir, MANIFEST_NAME))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def page_hashes(self, input_dir, names, known=None):
+        # 大小和修改时间没变的页直接用记录的哈希，只对新页或改过的页重新读文件；
+        # known 为边缘索引里已经核对过的 {页名: 哈希}，这些页也不用读文件
+        known = known or {}
+        hashes = []
+        for name in names:
+            stat = os.stat(os.path.join(input_dir, name))
+            row = self.db.execute('SELECT size, mtime_ns, hash FROM pages WHERE name = ?', (name,)).fetchone()
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                hashes.append(row[2])
+                continue
+            digest = known.get(name)
+            if digest is None:
+                with metrics.stage('hash', page=name):
+                    digest = file_hash(os.path.join(input_dir, name))
+            self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                            (name, stat.st_size, stat.st_mtime_ns, digest))
+            hashes.append(digest)
+        self.db.commit()
+        return hashes
+
+    def get_score(self, hash1, hash2, edge_width=5, metric='mse', exact=False):
+        # exact 为 True 时不返回提前淘汰时记下的下界
+        row = self.db.execute('SELECT error, exact FROM scores '
+                              'WHERE hash1 = ? AND hash2 = ? AND edge_width = ? AND metric = ?',
+                              (hash1, hash2, edge_width, metric)).fetchone()
+        return row[0] if row and (row[1] or not exact) else None
+
+    def put_scores(self, rows, edge_width=5, metric='mse', exact=True):
+        # 提前淘汰的页对记录的是不小于阈值的下界（exact=False），对配对结果来说与精确值等价；
+        # 下界不会覆盖已有的精确值
+        self.db.executemany('INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?) '
+                            'ON CONFLICT (hash1, hash2, edge_width, metric) DO UPDATE '
+                            'SET error = excluded.error, exact = excluded.exact WHERE excluded.exact >= scores.exact',
+                            [(hash1, hash2, edge_width, metric, error, int(exact)) for hash1, hash2, error in rows])
+        self.db.commit()
+
+    def set_state(self, name1, name2, state, output=None, error=None, hashes=(None, None)):
+        # hashes 为开始拼接时两页的文件哈希，resume 时用来确认文件还是同样的两页
+        if state == 'started':
+            self.db.execute('INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (name1, name2, output, error, state, *hashes))
+        else:
+            self.db.execute('UPDATE journal SET state = ? WHERE name1 = ? AND name2 = ?', (state, name1, name2))
+        self.db.commit()
+
+    def unfinished(self):
+        return self.db.execute("SELECT name1, name2, output, error, state, hash1, hash2 FROM journal "
+                               "WHERE state != 'done'").fetchall()
+
+    def drop_entry(self, name1, name2):
+        self.db.execute('DELETE FROM journal WHERE name1 = ? AND name2 = ?', (name1, name2))
+        self.db.commit()
+
+    def resume(self, input_dir, output_dir, join_pages):
+        # 把上次中断的页对做完：'started' 的重新写拼接结果，'joined' 的只补做移动。
+        # 还在输入目录里的页哈希与记录不同时（比如中断后又解压了另一本书），这一条作废，不拼接也不移动
+        for name1, name2, output, error, state, hash1, hash2 in self.unfinished():
+            img1_path = os.path.join(input_dir, name1)
+            img2_path = os.path.join(input_dir, name2)
+            present = [(name, expected) for name, expected in ((name1, hash1), (name2, hash2))
+                       if os.path.exists(os.path.join(input_dir, name))]
+            current = self.page_hashes(input_dir, [name for name, _ in present])
+            if current != [expected for _, expected in present] or (state == 'started' and len(present) < 2):
+                self.drop_entry(name1, name2)
+                continue
+            if state == 'started':
+                write_atomic(os.path.join(input_dir, output), join_pages(img1_path, img2_path))
+                self.set_state(name1, name2, 'joined')
+            for name, path in ((name1, img1_path), (name2, img2_path)):
+                if os.path.exists(path):
+                    shutil.move(path, os.path.join(output_dir, name))
+            self.set_state(name1, name2, 'done')
+            print(f"Resumed interrupted pair: {output}")
+
+
+def write_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
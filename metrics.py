@@ -0,0 +1,129 @@
+import os
+import csv
+import json
+import time
+from collections import defaultdict
+
+# 设置这个环境变量（或调用 metrics.enable）即可打开计时；子进程会继承它并写入同一个文件
+ENV_VAR = 'KPS_METRICS'
+
+FIELDS = ['stage', 'wall_ms', 'cpu_ms', 'page', 'pair', 'pid', 'info']
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'keys', 'wall', 'cpu')
+
+    def __init__(self, metrics, name, keys):
+        self.metrics = metrics
+        self.name = name
+        self.keys = keys
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.wall, time.thread_time() - self.cpu, **self.keys)
+        return False
+
+
+class Metrics:
+    # 各阶段的墙钟和 CPU 时间，写成 JSON Lines；关闭时 stage() 返回共用的空上下文管理器
+
+    def __init__(self):
+        self.path = None
+        self.export_path = None
+        self._file = None
+        self._pid = None
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def enable(self, path, fresh=True):
+        # path 以 .csv 结尾时，运行中仍写 JSON Lines，finish() 时再导出成 CSV
+        self.export_path = os.path.abspath(path) if path.lower().endswith('.csv') else None
+        self.path = os.path.abspath(path) + '.jsonl' if self.export_path else os.path.abspath(path)
+        if fresh:
+            open(self.path, 'w').close()
+        os.environ[ENV_VAR] = os.path.abspath(path)
+
+    def disable(self):
+        if self._file:
+            self._file.close()
+        self.path = self.export_path = self._file = None
+        os.environ.pop(ENV_VAR, None)
+
+    def stage(self, name, **keys):
+        if self.path is None:
+            return NULL_STAGE
+        return _Stage(self, name, keys)
+
+    def record(self, name, wall, cpu, page=None, pair=None, **info):
+        if self._file is None or self._pid != os.getpid():
+            # 追加模式按行写入，多个进程同时写也不会互相覆盖
+            self._file = open(self.path, 'a', buffering=1)
+            self._pid = os.getpid()
+        row = {'stage': name, 'wall_ms': round(wall * 1000, 3), 'cpu_ms': round(cpu * 1000, 3),
+               'page': page, 'pair': pair, 'pid': self._pid, 'info': info or None}
+        self._file.write(json.dumps(row) + '\n')
+
+    def load(self):
+        if self._file:
+            self._file.flush()
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def summary(self):
+        totals = defaultdict(lambda: [0, 0.0, 0.0])
+        modes = defaultdict(int)
+        for row in self.load():
+            total = totals[row['stage']]
+            total[0] += 1
+            total[1] += row['wall_ms']
+            total[2] += row['cpu_ms']
+            if row['info'] and 'image_mode' in row['info']:
+                modes[row['info']['image_mode']] += 1
+
+        grand_total = sum(total[1] for total in totals.values()) or 1.0
+        lines = [f"{'stage':<10} {'count':>7} {'wall ms':>11} {'cpu ms':>11} {'mean ms':>9} {'share':>7}"]
+        for name, (count, wall, cpu) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<10} {count:>7} {wall:>11.1f} {cpu:>11.1f} {wall / count:>9.2f} {wall / grand_total:>7.1%}")
+        if modes:
+            lines.append('encoded as: ' + ', '.join(f"{mode} {count}" for mode, count in sorted(modes.items())))
+        return '\n'.join(lines)
+
+    def finish(self):
+        if not self.enabled:
+            return
+        print(self.summary())
+        if self.export_path:
+            rows = self.load()
+            with open(self.export_path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                for row in rows:
+                    row['info'] = json.dumps(row['info']) if row['info'] else ''
+                    writer.writerow(row)
+            os.remove(self.path)
+            print(f"Metrics written to {self.export_path}")
+        else:
+            print(f"Metrics written to {self.path}")
+
+
+metrics = Metrics()
+
+if os.environ.get(ENV_VAR):
+    metrics.enable(os.environ[ENV_VAR], fresh=False)
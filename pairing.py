@@ -0,0 +1,33 @@
+def stride_pairs(errors, threshold=50):
+    # 旧的固定步长配对：(0,1), (2,3), ...
+    return [i for i in range(0, len(errors), 2) if errors[i] < threshold]
+
+
+def choose_pairs(errors, threshold=50):
+    # 动态规划：在不重叠的相邻页对中选出匹配数最多、总误差最小的一组。
+    # 返回每个页对的第一页下标 i（即配对 i 和 i+1）。
+    # 中间多出一页（封面、插页、缺页）只会影响它自己，不会让后面的配对整体错位。
+    n = len(errors) + 1
+    best = [(0, 0.0)] * (n + 1)
+    take = [False] * (n + 1)
+
+    for k in range(2, n + 1):
+        best[k] = best[k - 1]
+        error = errors[k - 2]
+        if error < threshold:
+            count, neg_total = best[k - 2]
+            candidate = (count + 1, neg_total - error)
+            if candidate > best[k]:
+                best[k] = candidate
+                take[k] = True
+
+    pairs = []
+    k = n
+    while k >= 2:
+        if take[k]:
+            pairs.append(k - 2)
+            k -= 2
+        else:
+            k -= 1
+    pairs.reverse()
+    return pairs
@@ -0,0 +1,235 @@
+import io
+import os
+import queue
+import zipfile
+import threading
+import numpy as np
+from PIL import Image
+
+from epub_extract import index_epub_images, output_filename
+from book_ops import page_sort_key, comic_info_xml
+from ImgStitchAuto import join_images, consecutive, edge_strips
+from manifest import write_atomic
+from color_mode import output_mode
+from encoder import encode_image, extension, profile_format
+from similarity import pair_error, THRESHOLDS
+from lossless_join import join_jpeg_bytes
+from pairing import choose_pairs
+from metrics import metrics
+
+# 从 EPUB 到成品的内存流水线：读页 -> 解码并取边缘 -> 配对 -> 拼接或直通 -> 写出。
+# 各阶段之间用有界队列连接，峰值内存只有几页，而不是整本书；只有要拼接或重新编码的页才完整解码。
+
+
+class Page:
+    __slots__ = ('name', 'data', 'is_jpeg', 'image', 'left', 'right')
+
+    def __init__(self, name, data, is_jpeg):
+        self.name = name
+        self.data = data
+        self.is_jpeg = is_jpeg
+        self.image = None
+        self.left = None
+        self.right = None
+
+
+def iter_epub_pages(epub_file):
+    # 按页码顺序产出原始字节，不落盘
+    with zipfile.ZipFile(epub_file, 'r') as zip_ref:
+        entries = [(output_filename(file_info, folder), file_info) for folder, file_info in index_epub_images(zip_ref)]
+        entries.sort(key=lambda entry: page_sort_key(entry[0]))
+        for name, file_info in entries:
+            with metrics.stage('extract', page=name):
+                data = zip_ref.read(file_info)
+            yield Page(name, data, not file_info.filename.lower().endswith('.png'))
+
+
+def decode_pages(pages, edge_width=5):
+    # JPEG 只解码亮度通道取边缘（与 edge_strips 相同），原样输出的页不再完整解码；
+    # PNG 无法部分解码，整页解码一次并留给后面编码
+    for page in pages:
+        if page.is_jpeg:
+            page.left, page.right, _ = edge_strips(io.BytesIO(page.data), edge_width, page=page.name)
+            yield page
+            continue
+        with metrics.stage('decode', page=page.name):
+            page.image = Image.open(io.BytesIO(page.data))
+            page.image.load()
+        with metrics.stage('grayscale', page=page.name):
+            width, height = page.image.size
+            page.left = np.array(page.image.crop((0, 0, edge_width, height)).convert('L'))
+            page.right = np.array(page.image.crop((width - edge_width, 0, width, height)).convert('L'))
+        yield page
+
+
+def load_image(page):
+    # 需要像素时（拼接或重新编码）才完整解码
+    if page.image is None:
+        with metrics.stage('decode', page=page.name, mode='full'):
+            page.image = Image.open(io.BytesIO(page.data))
+            page.image.load()
+    return page.image
+
+
+def pair_pages(pages, threshold=50, max_run=8, metric='mse'):
+    # 只有误差低于阈值的相邻页才可能成对，所以遇到不匹配的一对时，之前缓存的一段
+    # 可以单独做动态规划，结果与整本书一起算相同。max_run 限制缓存的页数：一段连续匹配的页
+    # 超过 max_run 时在这里被截断，截断处的一对不能成对，结果可能比整本书的动态规划少一对
+    run, errors = [], []
+    for page in pages:
+        if run:
+            with metrics.stage('compare', pair=f"{run[-1].name}-{page.name}"):
+                error = pair_error(run[-1].left, page.right, metric) if consecutive(run[-1].name, page.name) \
+                    else float('inf')
+            if error < threshold and len(run) < max_run:
+                run.append(page)
+                errors.append(error)
+                continue
+            yield from resolve_run(run, errors, threshold)
+            run, errors = [], []
+        run.append(page)
+    if run:
+        yield from resolve_run(run, errors, threshold)
+
+
+def resolve_run(run, errors, threshold):
+    chosen = set(choose_pairs(errors, threshold))
+    i = 0
+    while i < len(run):
+        if i in chosen:
+            yield run[i], run[i + 1]
+            i += 2
+        else:
+            yield run[i],
+            i += 1
+
+
+def render_items(items, profile=None):
+    # 单页 JPEG 原样输出；PNG 单页按配置编码；跨页优先无损拼接，否则用已解码的像素拼接再编码。
+    # 配置输出 WebP/AVIF 时所有页都重新编码
+    passthrough = profile_format(profile) == 'JPEG'
+    suffix = extension(profile)
+    for item in items:
+        if len(item) == 1:
+            page = item[0]
+            name = os.path.splitext(page.name)[0] + suffix
+            if page.is_jpeg and passthrough:
+                yield name, page.data
+            else:
+                image = load_image(page)
+                mode = output_mode(image)
+                with metrics.stage('encode', page=page.name, image_mode=mode, profile=profile):
+                    data = encode_image(image.convert(mode), profile, sources=(image,), quality=95)
+                yield name, data
+            continue
+
+        page1, page2 = item
+        name = f"{os.path.splitext(page1.name)[0]}-{os.path.splitext(page2.name)[0]}{suffix}"
+        joined_data = None
+        if passthrough and page1.is_jpeg and page2.is_jpeg:
+            with metrics.stage('join', pair=name, mode='lossless'):
+                joined_data = join_jpeg_bytes(page2.data, page1.data)  # page2 在左
+        if joined_data is None:
+            image1, image2 = load_image(page1), load_image(page2)
+            with metrics.stage('join', pair=name):
+                joined_image = join_images(image1, image2)
+            with metrics.stage('encode', pair=name, image_mode=joined_image.mode, profile=profile):
+                joined_data = encode_image(joined_image, profile, sources=(image1, image2))
+        yield name, joined_data
+
+
+def buffered(iterable, maxsize):
+    # 在后台线程里跑上游生成器，通过有界队列交给下游；队列满时上游阻塞（背压）
+    q = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        # 下游已经停止时不再等待队列空位，否则上游线程会一直阻塞
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(e)
+            return
+        put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class DirectoryWriter:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, name, data):
+        # 同名文件可能是指向共享存储的硬链接，替换而不是改写
+        write_atomic(os.path.join(self.output_dir, name), data)
+
+    def close(self):
+        return self.output_dir
+
+
+class CbzWriter:
+    def __init__(self, cbz_path, comic_info=True):
+        self.cbz_path = cbz_path
+        self.tmp_path = cbz_path + '.tmp'
+        self.comic_info = comic_info
+        self.entries = []
+        self.zf = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_STORED)
+
+    def write(self, name, data):
+        arcname = f"{len(self.entries) + 1:04d}{os.path.splitext(name)[1].lower()}"
+        self.zf.writestr(arcname, data)
+        self.entries.append((arcname, name, len(data)))
+
+    def close(self):
+        if self.comic_info:
+            title = os.path.splitext(os.path.basename(self.cbz_path))[0]
+            self.zf.writestr('ComicInfo.xml', comic_info_xml(title, self.entries), zipfile.ZIP_DEFLATED)
+        self.zf.close()
+        os.replace(self.tmp_path, self.cbz_path)
+        return self.cbz_path
+
+    def abort(self):
+        self.zf.close()
+        os.remove(self.tmp_path)
+
+
+def convert_epub(epub_file, writer, metric='mse', queue_size=4, max_run=8, progress=None, profile=None):
+    # 一次调用完成 EPUB -> 成品；writer 为 DirectoryWriter 或 CbzWriter，profile 为 encoder 里的编码配置
+    pages = buffered(iter_epub_pages(epub_file), queue_size)
+    decoded = buffered(decode_pages(pages), queue_size)
+    outputs = buffered(render_items(pair_pages(decoded, THRESHOLDS[metric], max_run, metric), profile), queue_size)
+    try:
+        for done, (name, data) in enumerate(outputs, 1):
+            with metrics.stage('write', page=name):
+                writer.write(name, data)
+            if progress:
+                progress(done, None)
+    except BaseException:
+        if hasattr(writer, 'abort'):
+            writer.abort()
+        raise
+    return writer.close()
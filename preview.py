@@ -0,0 +1,101 @@
+import os
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageTk
+
+
+def load_thumbnail(path, size):
+    # JPEG 用 draft 按 1/2、1/4、1/8 缩小解码，不再整页解码后再缩
+    with Image.open(path) as img:
+        img.draft('RGB', size)
+        img.thumbnail(size)
+        return img.copy()
+
+
+class ThumbnailCache:
+    # 后台线程解码缩略图，按 (路径, mtime) 缓存最近用过的 PhotoImage；PhotoImage 只在 Tk 线程的轮询里创建
+
+    def __init__(self, widget, size=(180, 180), capacity=64, workers=2, poll_ms=30):
+        self.widget = widget
+        self.size = size
+        self.capacity = capacity
+        self.poll_ms = poll_ms
+        self.cache = OrderedDict()
+        self.waiting = {}
+        self.futures = {}
+        self.results = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.after_id = self.widget.after(self.poll_ms, self._poll)
+        # 窗口关闭时停掉轮询和线程池（每个图库窗口都有自己的缓存）
+        self.widget.bind('<Destroy>', self._on_destroy, add='+')
+
+    def key(self, path):
+        try:
+            return os.path.normpath(path), os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self, path, callback):
+        # 已缓存时立即回调并返回 PhotoImage；否则在后台解码，完成后在 Tk 线程回调
+        key = self.key(path)
+        if key is None:
+            return None
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            callback(self.cache[key])
+            return self.cache[key]
+
+        if key not in self.waiting:
+            self.waiting[key] = []
+            self.futures[key] = self.pool.submit(self._load, key)
+        self.waiting[key].append(callback)
+        return None
+
+    def cancel(self, path):
+        # 不再需要的页（例如滚出可见区域）：还在排队的解码直接取消，已经开始的完成后不回调
+        key = self.key(path)
+        if key not in self.waiting:
+            return
+        if self.futures[key].cancel():
+            del self.waiting[key], self.futures[key]
+        else:
+            self.waiting[key] = []
+
+    def close(self):
+        if self.after_id is not None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.waiting.clear()
+        self.futures.clear()
+
+    def _on_destroy(self, event):
+        # 子控件销毁时也会收到 <Destroy>，只处理窗口本身
+        if event.widget is self.widget:
+            self.close()
+
+    def _load(self, key):
+        try:
+            self.results.put((key, load_thumbnail(key[0], self.size)))
+        except Exception as e:
+            self.results.put((key, e))
+
+    def _poll(self):
+        try:
+            while True:
+                key, img = self.results.get_nowait()
+                callbacks = self.waiting.pop(key, [])
+                self.futures.pop(key, None)
+                if isinstance(img, Exception):
+                    continue
+                photo = ImageTk.PhotoImage(img)
+                self.cache[key] = photo
+                while len(self.cache) > self.capacity:
+                    self.cache.popitem(last=False)
+                for callback in callbacks:
+                    callback(photo)
+        except queue.Empty:
+            pass
+        if self.after_id is not None:
+            self.after_id = self.widget.after(self.poll_ms, self._poll)
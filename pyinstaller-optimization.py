@@ -1,6 +1,40 @@
 import os
 import sys
-from PyInstaller.__main__ import run
+import ast
+import json
+import time
+import shutil
+import argparse
+import importlib.util
+import subprocess
+
+# 按入口分别计算真正会导入的模块（包括函数里的延迟导入），没用到的大包直接排除；
+# 每个入口可以打 onedir 和 onefile 两种包，并报告包大小和实测启动时间。
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 名称 -> (脚本, 是否为窗口程序, 测量启动时间时传的参数)
+ENTRY_POINTS = {
+    'gui': ('EPUBtoPicOne.py', True, []),
+    'autostitch': ('ImgStitchAuto.py', False, ['--help']),
+    'autostitch-log': ('ImgStitchAutoLog.py', False, ['--help']),
+    'cli': ('kindlepicstitch.py', False, ['--help']),
+}
+
+# 环境里常见、体积大、但不一定用得到的包；只有入口确实导入不到时才排除
+HEAVY_PACKAGES = ['numpy', 'cv2', 'skimage', 'scipy', 'matplotlib', 'pandas', 'IPython', 'PyQt5', 'PySide6',
+                  'tkinter', 'tkinterdnd2', 'PIL.ImageQt']
+
+
+def local_modules():
+    # 仓库里可以被 import 的脚本（本文件名带连字符，不算）
+    modules = {}
+    for name in os.listdir(ROOT):
+        module, ext = os.path.splitext(name)
+        if ext == '.py' and module.isidentifier():
+            modules[module] = os.path.join(ROOT, name)
+    return modules
+
 
 def read_file_content(file_path):
     encodings = ['utf-8', 'gbk', 'iso-8859-1']
@@ -13,52 +47,168 @@ def read_file_content(file_path):
     print(f"Error: Unable to read the file {file_path} with any of the attempted encodings.")
     return None
 
-if __name__ == "__main__":
-    script_name = input("Enter the name of your main script (e.g., your_script.py): ").strip()
-    
-    if not os.path.exists(script_name):
-        print(f"Error: The file {script_name} does not exist.")
-        sys.exit(1)
 
-    # 基本配置
+def imports_of(path):
+    # 所有 import 语句，不管在模块顶层还是函数里；PyInstaller 同样会把函数里的导入打包进去
+    names = set()
+    for node in ast.walk(ast.parse(read_file_content(path) or '', path)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module)
+            names.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return names
+
+
+def import_graph(script):
+    # 返回 (入口能到达的本地模块, 能到达的外部模块全名)
+    local = local_modules()
+    entry = os.path.splitext(os.path.basename(script))[0]
+    seen, external = set(), set()
+    stack = [entry]
+    while stack:
+        module = stack.pop()
+        if module in seen:
+            continue
+        seen.add(module)
+        for name in imports_of(local[module]):
+            top = name.split('.')[0]
+            if top in local:
+                stack.append(top)
+            else:
+                external.add(name)
+    return seen, external
+
+
+def is_reachable(package, external):
+    return any(name == package or name.startswith(package + '.') for name in external)
+
+
+def installed(package):
+    try:
+        return importlib.util.find_spec(package) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def pyinstaller_args(name, variant, dist_dir, work_dir):
+    script, windowed, _ = ENTRY_POINTS[name]
+    local, external = import_graph(script)
+    excluded = [package for package in HEAVY_PACKAGES
+                if not is_reachable(package, external) and installed(package.split('.')[0])]
+
     args = [
-        script_name,
-        '--onefile',
-        '--windowed',
-        '--name=EPUBtoPicOne',
-        
-        # 排除不必要的模块
-        '--exclude-module=matplotlib',
-        '--exclude-module=numpy',
-        '--exclude-module=pandas',
-        
-        # 仅包含必要的 tkinter 模块
-        '--collect-submodules=tkinter',
-        '--collect-data=tkinter',
-        
-        # 针对特定库的优化
-        '--collect-submodules=PIL',
-        
-        # 清理
+        os.path.join(ROOT, script),
+        f'--{variant}',
+        f'--name={bundle_name(name)}',
+        f'--distpath={dist_dir}',
+        f'--workpath={work_dir}',
+        f'--specpath={work_dir}',
+        '--noconfirm',
         '--clean',
     ]
-    
-    # 读取文件内容
-    content = read_file_content(script_name)
-    if content is None:
-        sys.exit(1)
-
-    # 检查是否使用了 tkinterdnd2
-    if 'tkinterdnd2' in content:
-        tkinterdnd2_path = os.path.join(sys.prefix, 'Lib', 'site-packages', 'tkinterdnd2')
-        if os.path.exists(tkinterdnd2_path):
-            args.extend(['--add-data', f'{tkinterdnd2_path}:tkinterdnd2'])
+    if windowed:
+        args.append('--windowed')
+    args += [f'--exclude-module={package}' for package in excluded]
+
+    # tkinterdnd2 的 Tcl 扩展是数据文件，PyInstaller 分析不到
+    if is_reachable('tkinterdnd2', external):
+        spec = importlib.util.find_spec('tkinterdnd2')
+        if spec and spec.submodule_search_locations:
+            args.extend(['--add-data', f'{list(spec.submodule_search_locations)[0]}{os.pathsep}tkinterdnd2'])
         else:
             print("Warning: tkinterdnd2 is used in the script but not found in the expected location.")
 
-    # 运行 PyInstaller
-    print("Starting PyInstaller with the following arguments:")
-    print(" ".join(args))
-    run(args)
+    third_party = sorted({module.split('.')[0] for module in external} - set(sys.stdlib_module_names))
+    return args, {'local_modules': sorted(local), 'third_party': third_party, 'excluded': excluded}
+
+
+def bundle_name(name):
+    return os.path.splitext(ENTRY_POINTS[name][0])[0]
+
+
+def executable_path(name, variant, dist_dir):
+    exe = bundle_name(name) + ('.exe' if sys.platform == 'win32' else '')
+    if variant == 'onedir':
+        return os.path.join(dist_dir, bundle_name(name), exe)
+    return os.path.join(dist_dir, exe)
+
+
+def bundle_size(name, variant, dist_dir):
+    if variant == 'onefile':
+        return os.path.getsize(executable_path(name, variant, dist_dir))
+    total = 0
+    for directory, _, files in os.walk(os.path.join(dist_dir, bundle_name(name))):
+        total += sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+    return total
+
+
+def measure_startup(name, variant, dist_dir, runs=3):
+    # 命令行入口计到 --help 输出完毕；GUI 设置 KPS_STARTUP_PROBE，窗口第一次画完就退出。
+    # 第一次运行近似冷启动（onefile 要先解包），之后取最小值
+    _, _, probe_args = ENTRY_POINTS[name]
+    env = dict(os.environ, KPS_STARTUP_PROBE='1')
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([executable_path(name, variant, dist_dir)] + probe_args, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+        times.append(time.perf_counter() - started)
+    return {'first_s': times[0], 'warm_s': min(times[1:] or times)}
 
-print("PyInstaller process completed. Check the 'dist' folder for your executable.")
\ No newline at end of file
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build slim PyInstaller bundles per entry point")
+    parser.add_argument('entries', nargs='*', metavar='entry',
+                        help=f"entry points to build: {', '.join(ENTRY_POINTS)} (default: all)")
+    parser.add_argument('--variant', choices=['onedir', 'onefile', 'both'], default='both')
+    parser.add_argument('--dist', default=os.path.join(ROOT, 'dist'))
+    parser.add_argument('--build', default=os.path.join(ROOT, 'build'))
+    parser.add_argument('--runs', type=int, default=3, help="launches per bundle for the startup measurement")
+    parser.add_argument('--dry-run', action='store_true', help="only print the import analysis and arguments")
+    parser.add_argument('--report', help="where to write the JSON report (default: build_report.json under --build)")
+    args = parser.parse_args(argv)
+
+    entries = args.entries or list(ENTRY_POINTS)
+    unknown = [name for name in entries if name not in ENTRY_POINTS]
+    if unknown:
+        parser.error(f"unknown entry point(s): {', '.join(unknown)}")
+    variants = ['onedir', 'onefile'] if args.variant == 'both' else [args.variant]
+    report = []
+    for name in entries:
+        for variant in variants:
+            dist_dir = os.path.join(args.dist, variant)
+            work_dir = os.path.join(args.build, f'{name}-{variant}')
+            pyinstaller_options, analysis = pyinstaller_args(name, variant, dist_dir, work_dir)
+            print(f"[{name} {variant}] third-party: {', '.join(analysis['third_party']) or '-'}; "
+                  f"excluded: {', '.join(analysis['excluded']) or '-'}")
+            entry = {'entry': name, 'variant': variant, **analysis}
+            if args.dry_run:
+                print(" ".join(pyinstaller_options))
+                continue
+
+            from PyInstaller.__main__ import run
+
+            shutil.rmtree(work_dir, ignore_errors=True)
+            started = time.perf_counter()
+            run(pyinstaller_options)
+            entry['build_s'] = time.perf_counter() - started
+            entry['size_bytes'] = bundle_size(name, variant, dist_dir)
+            entry['startup'] = measure_startup(name, variant, dist_dir, args.runs)
+            report.append(entry)
+
+    if args.dry_run:
+        return
+    print(f"{'entry':<15} {'variant':<8} {'size MB':>9} {'first s':>8} {'warm s':>8}")
+    for entry in report:
+        print(f"{entry['entry']:<15} {entry['variant']:<8} {entry['size_bytes'] / 1e6:>9.1f} "
+              f"{entry['startup']['first_s']:>8.2f} {entry['startup']['warm_s']:>8.2f}")
+    report_path = args.report or os.path.join(args.build, 'build_report.json')
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import numpy as np
+
+# 边缘相似度指标。所有页对的边缘条按尺寸分组后堆成一个批量数组，全程用 uint8/int32/int64 整数运算；
+# 误差只增不减的指标按行块累加，累计误差已超过阈值的页对提前淘汰，不再计算剩下的行。
+# edge1 是右侧页（img1）的左边缘，edge2 是左侧页（img2）的右边缘，与 ImgStitchAuto 一致。
+
+# 每个行块内用 int32 累加（64 行 x 5 列 x 255² 远小于 2³¹），块之间再用 int64 累加
+BLOCK_ROWS = 64
+
+
+def mse_stats(a, b):
+    diff = np.subtract(a, b, dtype=np.int32)
+    return np.einsum('nij,nij->n', diff, diff)[:, None]
+
+
+def mse_error(stats, rows, width):
+    return stats[:, 0] / (rows * width)
+
+
+def ncc_stats(a, b):
+    a = a.reshape(len(a), -1).astype(np.int32)
+    b = b.reshape(len(b), -1).astype(np.int32)
+    return np.stack([a.sum(1), b.sum(1), np.einsum('ni,ni->n', a, a), np.einsum('ni,ni->n', b, b),
+                     np.einsum('ni,ni->n', a, b)], axis=1)
+
+
+def ncc_error(stats, rows, width):
+    # 1 - 归一化互相关；两边都是纯色时按均值是否相同算 0 或 1
+    n = rows * width
+    sum_a, sum_b, sum_aa, sum_bb, sum_ab = stats.T
+    var_a = n * sum_aa - sum_a * sum_a
+    var_b = n * sum_bb - sum_b * sum_b
+    cov = n * sum_ab - sum_a * sum_b
+    denom = np.sqrt(var_a.astype(np.float64) * var_b)
+    flat = np.where((var_a == 0) & (var_b == 0) & (sum_a == sum_b), 1.0, 0.0)
+    ncc = np.where(denom > 0, cov / np.where(denom > 0, denom, 1.0), flat)
+    return 1.0 - ncc
+
+
+def gradient_stats(a, b):
+    # 接缝两侧的梯度应连续：用两侧各两列外推接缝处的值，残差为二阶差分（乘 2 以保持整数）
+    a = a.astype(np.int32)
+    b = b.astype(np.int32)
+    residual = 3 * a[:, :, 0] - a[:, :, 1] - 3 * b[:, :, -1] + b[:, :, -2]
+    return np.einsum('ni,ni->n', residual, residual)[:, None]
+
+
+def gradient_error(stats, rows, width):
+    return stats[:, 0] / (4 * rows)
+
+
+# 名称 -> (按行块累加的统计量, 由统计量算误差, 误差是否随行数单调不减)
+METRICS = {
+    'mse': (mse_stats, mse_error, True),
+    'ncc': (ncc_stats, ncc_error, False),
+    'gradient': (gradient_stats, gradient_error, True),
+}
+
+THRESHOLDS = {'mse': 50, 'ncc': 0.1, 'gradient': 50}
+
+
+def group_errors(edges1, edges2, rows, metric, threshold=None, block_rows=BLOCK_ROWS):
+    # 同一组的边缘条高度至少为 rows、宽度相同；返回每对的误差
+    stats_fn, error_fn, monotonic = METRICS[metric]
+    width = edges1[0].shape[1]
+    if not monotonic:
+        threshold = None
+
+    # 能提前淘汰时先只堆叠第一个行块，大多数页对在这里就被排除，剩下的行只为留下的页对堆叠
+    head = min(block_rows, rows) if threshold is not None else rows
+    active = np.arange(len(edges1))
+    stats = None
+    for low, high in ((0, head), (head, rows)):
+        if low >= high or not len(active):
+            continue
+        a = np.stack([edges1[i][low:high] for i in active])
+        b = np.stack([edges2[i][low:high] for i in active])
+        local = np.arange(len(active))
+        for start in range(0, high - low, block_rows):
+            end = start + block_rows
+            if len(local) == len(a):
+                block = stats_fn(a[:, start:end], b[:, start:end])
+            else:
+                block = stats_fn(a[local, start:end], b[local, start:end])
+            if stats is None:
+                stats = np.zeros((len(edges1), block.shape[1]), dtype=np.int64)
+            stats[active[local]] += block
+            # 按整页行数换算，累计值只会变大，所以已超过阈值的不可能再低于阈值
+            if threshold is not None:
+                local = local[error_fn(stats[active[local]], rows, width) < threshold]
+                if not len(local):
+                    break
+        active = active[local]
+    return error_fn(stats, rows, width)
+
+
+def batch_errors(pairs, metric='mse', threshold=None, block_rows=BLOCK_ROWS):
+    # pairs 为 [(edge1, edge2), ...]，高度不同时按较矮的一边裁齐。
+    # 给出 threshold 时，被提前淘汰的页对返回的是已不小于阈值的下界，而不是精确误差
+    errors = np.empty(len(pairs))
+    groups = {}
+    for i, (edge1, edge2) in enumerate(pairs):
+        rows = min(edge1.shape[0], edge2.shape[0])
+        groups.setdefault((rows, edge1.shape[1], edge2.shape[1]), []).append(i)
+
+    for (rows, _, _), indices in groups.items():
+        errors[indices] = group_errors([pairs[i][0] for i in indices], [pairs[i][1] for i in indices],
+                                       rows, metric, threshold, block_rows)
+    return errors.tolist()
+
+
+def pair_error(edge1, edge2, metric='mse'):
+    return batch_errors([(edge1, edge2)], metric)[0]
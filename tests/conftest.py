@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 仓库里的模块是根目录下的脚本，不是包；直接运行 pytest 时也要能导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
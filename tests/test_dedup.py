@@ -0,0 +1,78 @@
+import io
+import os
+import zipfile
+
+import pytest
+from PIL import Image, ImageDraw
+
+from dedup import ContentStore, content_hash, perceptual_hash
+from epub_extract import extract_epub
+
+
+def page_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 60), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def title_page(text, quality=90):
+    # 白底上的一行字：文字不同的页感知哈希也相同
+    img = Image.new('RGB', (800, 1200), 'white')
+    ImageDraw.Draw(img).text((340, 560), text, fill='black', font_size=40)
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def make_epub(path, data):
+    with zipfile.ZipFile(path, 'w') as zip_ref:
+        zip_ref.writestr('images/1.jpg', data)
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ContentStore(str(tmp_path / 'store'))
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize('dedup_second', [True, False])
+def test_overwriting_linked_page_keeps_store_object(tmp_path, store, dedup_second):
+    # 第二次解压到同一目录时，页面是指向存储对象的硬链接；覆盖它不能改写存储里的对象
+    red, blue = page_bytes('red'), page_bytes('blue')
+    red_epub = make_epub(tmp_path / 'red.epub', red)
+    blue_epub = make_epub(tmp_path / 'blue.epub', blue)
+    first, second = str(tmp_path / 'first'), str(tmp_path / 'second')
+
+    extract_epub(red_epub, first, workers=1, store=store, edge_index=False)
+    extract_epub(red_epub, second, workers=1, store=store, edge_index=False)
+    object_path = store.lookup_page(content_hash(red))
+    assert os.path.samefile(object_path, os.path.join(second, '1.jpg'))
+    assert not os.path.samefile(object_path, os.path.join(first, '1.jpg'))
+
+    extract_epub(blue_epub, second, workers=1, store=store if dedup_second else None, edge_index=False)
+
+    with open(os.path.join(second, '1.jpg'), 'rb') as f:
+        assert f.read() == blue
+    for path in (object_path, os.path.join(first, '1.jpg')):
+        with open(path, 'rb') as f:
+            assert f.read() == red
+
+
+def test_perceptual_match_links_only_identical_pixels(tmp_path, store):
+    chapter1, chapter7, reencoded = title_page('Chapter 1'), title_page('Chapter 7'), title_page('Chapter 1', 75)
+    assert perceptual_hash(chapter1) == perceptual_hash(chapter7) == perceptual_hash(reencoded)
+
+    outputs = {}
+    for name, data in [('chapter1', chapter1), ('chapter7', chapter7), ('reencoded', reencoded)]:
+        outputs[name] = os.path.join(str(tmp_path / name), '1.jpg')
+        extract_epub(make_epub(tmp_path / f'{name}.epub', data), str(tmp_path / name), workers=1, store=store,
+                     perceptual=True, edge_index=False)
+
+    # 文字不同的页照常写出；只是重新编码的页链接到已有的对象，并按自己的内容哈希登记
+    with open(outputs['chapter7'], 'rb') as f:
+        assert f.read() == chapter7
+    object_path = store.lookup_page(content_hash(chapter1))
+    assert os.path.samefile(outputs['reencoded'], object_path)
+    assert store.lookup_page(content_hash(reencoded)) == object_path
@@ -0,0 +1,91 @@
+import os
+import re
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from ImgStitchAuto import process_images
+from manifest import Manifest
+
+
+def write_page(path, seed):
+    # 随机噪声页：相邻页的误差都远高于阈值，不会被拼接，重复运行时页面都还在
+    pixels = np.random.default_rng(seed).integers(0, 256, (60, 40, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, 'JPEG')
+
+
+def run(book, capsys):
+    results = []
+    process_images(str(book), str(book / 'Stitched'), on_result=lambda *args: results.append(args))
+    reused, decoded = map(int, re.search(r"Reused (\d+) cached scores.*decoded edges of (\d+) pages",
+                                         capsys.readouterr().out).groups())
+    return results, reused, decoded
+
+
+def test_rerun_reuses_scores_of_unchanged_pages(tmp_path, capsys):
+    for number in range(1, 5):
+        write_page(tmp_path / f'{number}.jpg', number)
+
+    first, reused, decoded = run(tmp_path, capsys)
+    assert (reused, decoded) == (0, 4)
+    assert run(tmp_path, capsys) == (first, 3, 0)
+
+    # 改过的页重新解码，只有与它相邻的两对重新计算
+    write_page(tmp_path / '3.jpg', 30)
+    _, reused, decoded = run(tmp_path, capsys)
+    assert (reused, decoded) == (1, 3)
+
+
+@pytest.fixture
+def book(tmp_path):
+    input_dir, output_dir = tmp_path / 'book', tmp_path / 'book' / 'Stitched'
+    input_dir.mkdir()
+    write_page(input_dir / '5.jpg', 5)
+    write_page(input_dir / '6.jpg', 6)
+    manifest = Manifest.open(str(output_dir))
+    yield manifest, str(input_dir), str(output_dir)
+    manifest.close()
+
+
+def interrupt(manifest, input_dir, state):
+    # 模拟在 state 状态下中断：'joined' 时拼接结果已经写出，原页还没移走
+    hashes = manifest.page_hashes(input_dir, ['5.jpg', '6.jpg'])
+    manifest.set_state('5.jpg', '6.jpg', 'started', '5-6.jpg', 1.0, tuple(hashes))
+    if state == 'joined':
+        with open(os.path.join(input_dir, '5-6.jpg'), 'wb') as f:
+            f.write(b'joined before the crash')
+        manifest.set_state('5.jpg', '6.jpg', 'joined')
+
+
+@pytest.mark.parametrize('state', ['started', 'joined'])
+def test_resume_finishes_interrupted_pair(book, state):
+    manifest, input_dir, output_dir = book
+    interrupt(manifest, input_dir, state)
+    joins = []
+
+    def join_pages(path1, path2):
+        joins.append((os.path.basename(path1), os.path.basename(path2)))
+        return b'joined on resume'
+
+    manifest.resume(input_dir, output_dir, join_pages)
+
+    assert joins == ([('5.jpg', '6.jpg')] if state == 'started' else [])
+    with open(os.path.join(input_dir, '5-6.jpg'), 'rb') as f:
+        assert f.read() == (b'joined on resume' if state == 'started' else b'joined before the crash')
+    assert sorted(name for name in os.listdir(output_dir) if name.endswith('.jpg')) == ['5.jpg', '6.jpg']
+    assert manifest.unfinished() == []
+
+
+@pytest.mark.parametrize('state', ['started', 'joined'])
+def test_resume_drops_pair_whose_pages_changed(book, state):
+    # 中断后又解压了另一本书：同名的页内容不同，不能拼接或移走
+    manifest, input_dir, output_dir = book
+    interrupt(manifest, input_dir, state)
+    write_page(os.path.join(input_dir, '6.jpg'), 60)
+
+    manifest.resume(input_dir, output_dir, lambda *paths: pytest.fail("joined pages of another book"))
+
+    assert os.path.exists(os.path.join(input_dir, '5.jpg')) and os.path.exists(os.path.join(input_dir, '6.jpg'))
+    assert not [name for name in os.listdir(output_dir) if name.endswith('.jpg')]
+    assert manifest.unfinished() == []
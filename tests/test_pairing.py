@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from pairing import choose_pairs
+
+
+def brute_force(errors, threshold):
+    # 枚举所有互不重叠的相邻页对组合，取 (对数最多, 总误差最小)
+    best = (0, 0.0)
+
+    def search(i, count, total):
+        nonlocal best
+        if i >= len(errors):
+            best = max(best, (count, -total))
+            return
+        search(i + 1, count, total)
+        if errors[i] < threshold:
+            search(i + 2, count + 1, total + errors[i])
+
+    search(0, 0, 0.0)
+    return best
+
+
+def score(pairs, errors):
+    return len(pairs), -sum(errors[i] for i in pairs)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_choose_pairs_matches_brute_force(seed):
+    rng = random.Random(seed)
+    threshold = 50
+    errors = [rng.choice([rng.uniform(0, threshold), rng.uniform(threshold, 3 * threshold), float('inf')])
+              for _ in range(rng.randint(0, 11))]
+    pairs = choose_pairs(errors, threshold)
+
+    assert all(b - a >= 2 for a, b in zip(pairs, pairs[1:]))
+    assert all(errors[i] < threshold for i in pairs)
+    assert score(pairs, errors) == pytest.approx(brute_force(errors, threshold))
+
+
+def test_choose_pairs_keeps_alignment_after_insert():
+    # 下标 2 的页是插页：后面的跨页仍然按 (3,4), (5,6) 配对，而不是整体错位
+    assert choose_pairs([10, 90, 90, 5, 90, 5], 50) == [0, 3, 5]
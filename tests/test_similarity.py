@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from similarity import METRICS, THRESHOLDS, batch_errors
+
+
+def random_pairs(seed, count=60, edge_width=5):
+    # 一半是同一张平滑图切开的两边（接得上），一半是随机内容；高度各不相同，会分成几组
+    rng = np.random.default_rng(seed)
+    pairs = []
+    for i in range(count):
+        rows = int(rng.integers(1, 300))
+        if i % 2:
+            base = rng.integers(20, 200, (rows, 1))
+            ramp = np.arange(2 * edge_width) * rng.uniform(-1, 1)
+            spread = base + ramp + rng.integers(-3, 4, (rows, 2 * edge_width))
+            spread = np.clip(spread, 0, 255).astype(np.uint8)
+            # edge1 是右侧页的左边缘，edge2 是左侧页的右边缘
+            edge1, edge2 = spread[:, edge_width:], spread[:, :edge_width]
+        else:
+            edge1 = rng.integers(0, 256, (rows, edge_width), dtype=np.uint8)
+            edge2 = rng.integers(0, 256, (rows + int(rng.integers(0, 20)), edge_width), dtype=np.uint8)
+        pairs.append((edge1, edge2))
+    return pairs
+
+
+@pytest.mark.parametrize('metric', sorted(METRICS))
+@pytest.mark.parametrize('seed', range(5))
+def test_early_rejection_is_exact_below_threshold(metric, seed):
+    pairs = random_pairs(seed)
+    threshold = THRESHOLDS[metric]
+    exact = batch_errors(pairs, metric, block_rows=16)
+    bounded = batch_errors(pairs, metric, threshold, block_rows=16)
+
+    assert any(error < threshold for error in exact) and any(error >= threshold for error in exact)
+    for full, bound in zip(exact, bounded):
+        if full < threshold:
+            assert bound == pytest.approx(full)
+        else:
+            # 被淘汰的页对给出的是下界：不超过精确值，也不会低于阈值
+            assert threshold <= bound <= full + 1e-9
+
+
+def test_exact_errors_match_reference():
+    pairs = random_pairs(0, count=10)
+    for (edge1, edge2), error in zip(pairs, batch_errors(pairs, 'mse', block_rows=16)):
+        rows = min(len(edge1), len(edge2))
+        diff = edge1[:rows].astype(np.float64) - edge2[:rows]
+        assert error == pytest.approx(np.mean(diff ** 2))
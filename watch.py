@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import time
+import queue
+import select
+import struct
+import zipfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from manifest import write_atomic
+
+# 监视一个收件目录：新拖进来的 EPUB 解压到 OUTPUT_ROOT/<书名>/ 并自动拼接；
+# 直接放进收件目录的页面文件夹原地自动拼接。清单里按哈希缓存了比较分数，
+# 所以文件夹里新增几页时只会解码新页和它们的相邻页。
+
+STATE_NAME = '.kindlepicstitch-watch.json'
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def is_page_name(name):
+    # 与 ImgStitchAuto.list_images 一致：只有纯数字的 .jpg 参与自动拼接
+    return name.endswith('.jpg') and name[:-4].isdigit()
+
+
+def signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def scan(root):
+    # 收件目录第一层的文件，以及第一层文件夹里的文件（不进入 Stitched 等更深的目录）
+    found = {}
+    for entry in os.scandir(root):
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_file():
+            found[entry.path] = signature(entry.path)
+        elif entry.is_dir():
+            for child in os.scandir(entry.path):
+                if child.is_file() and not child.name.startswith('.'):
+                    found[child.path] = signature(child.path)
+    return found
+
+
+class InotifySource:
+    # Linux 上通过 ctypes 用 inotify 监视收件目录和其下第一层文件夹
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+
+    def __init__(self, root):
+        import ctypes
+        import ctypes.util
+
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.add_watch(root)
+        for entry in os.scandir(root):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                self.add_watch(entry.path)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def changes(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b'\0'))
+            offset += 16 + length
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                # 新文件夹：加监视，并补上加监视之前已经写进去的文件
+                if directory == self.root and not name.startswith('.'):
+                    self.add_watch(path)
+                    paths.extend(entry.path for entry in os.scandir(path) if entry.is_file())
+                continue
+            paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingSource:
+    # 其他平台和网络共享上的后备方案：比较两次目录快照
+
+    def __init__(self, root, interval=1.0):
+        self.root = root
+        self.interval = interval
+        self.snapshot = scan(root)
+        self.last_scan = time.monotonic()
+
+    def changes(self, timeout):
+        time.sleep(max(0.0, min(timeout, self.last_scan + self.interval - time.monotonic())))
+        if time.monotonic() - self.last_scan < self.interval:
+            return []
+        current = scan(self.root)
+        self.last_scan = time.monotonic()
+        changed = [path for path, sig in current.items() if self.snapshot.get(path) != sig]
+        self.snapshot = current
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_source(root, poll=False, interval=1.0):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifySource(root)
+        except (OSError, AttributeError):
+            pass
+    return PollingSource(root, interval)
+
+
+class Watcher:
+    # 常驻的收件目录监视：文件大小和修改时间稳定 settle 秒后才处理，任务在工作线程上依次运行
+
+    def __init__(self, inbox, output_root, settle=2.0, poll=False, interval=1.0, workers=1, pairing='optimal',
+                 metric='mse', store_path=None, status_path=None, status_port=None):
+        self.inbox = os.path.abspath(inbox)
+        self.output_root = os.path.abspath(output_root)
+        self.settle = settle
+        self.workers = workers
+        self.pairing = pairing
+        self.metric = metric
+        self.store_path = store_path
+        self.status_path = status_path or os.path.join(self.output_root, 'watch-status.json')
+        self.status_port = status_port
+        self.source = make_source(self.inbox, poll, interval)
+
+        self.pending = {}           # 路径 -> (大小和修改时间, 最后一次变化的时间)
+        self.jobs = queue.Queue()
+        self.queued = set()
+        self.waiting_folders = set()  # 已有页面稳定、但文件夹里还有文件在写入的页面文件夹
+        self.book_dirs = set()      # 自己解压出来的书目录，不当作新放进来的页面文件夹
+        self.lock = threading.Lock()
+        self.state_path = os.path.join(self.output_root, STATE_NAME)
+        self.done_epubs = self.load_state()
+        for path in self.done_epubs:
+            self.book_dirs.add(self.book_dir(path))
+        self.stats = {'inbox': self.inbox, 'source': type(self.source).__name__, 'started': time.time(),
+                      'state': 'idle', 'current': None, 'jobs_done': 0, 'jobs_failed': 0, 'pages_done': 0,
+                      'busy_seconds': 0.0, 'last_error': None}
+        self.last_status = 0.0
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def book_dir(self, epub_path):
+        return os.path.join(self.output_root, os.path.splitext(os.path.basename(epub_path))[0])
+
+    def touch(self, path):
+        self.pending[path] = (signature(path), time.monotonic())
+
+    def settled(self):
+        now = time.monotonic()
+        for path, (sig, since) in list(self.pending.items()):
+            current = signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != sig:
+                self.pending[path] = (current, now)
+            elif now - since >= self.settle:
+                # 复制中的 EPUB 还没有中央目录，打不开时继续等
+                if path.lower().endswith('.epub') and not zipfile.is_zipfile(path):
+                    self.pending[path] = (current, now)
+                    continue
+                del self.pending[path]
+                yield path
+
+    def target_of(self, path):
+        parts = os.path.relpath(path, self.inbox).split(os.sep)
+        name = parts[-1]
+        if name.startswith('.') or name.endswith('.tmp'):
+            return None
+        if len(parts) == 1 and name.lower().endswith('.epub'):
+            with self.lock:
+                if self.done_epubs.get(path) == list(signature(path) or ()):
+                    return None
+            return 'epub', path
+        if len(parts) == 2 and is_page_name(name):
+            folder = os.path.join(self.inbox, parts[0])
+            if folder not in self.book_dirs:
+                return 'folder', folder
+        return None
+
+    def folders_settled(self):
+        # 页面文件夹里所有文件都稳定后才整体入队，不在复制到一半时就开始拼接
+        for folder in list(self.waiting_folders):
+            prefix = folder + os.sep
+            if not any(path.startswith(prefix) for path in self.pending):
+                self.waiting_folders.discard(folder)
+                yield 'folder', folder
+
+    def enqueue(self, target):
+        with self.lock:
+            if target in self.queued:
+                return
+            self.queued.add(target)
+        self.jobs.put(target)
+
+    def status(self):
+        with self.lock:
+            status = dict(self.stats)
+        status['queue_depth'] = self.jobs.qsize()
+        status['settling_files'] = len(self.pending)
+        status['pages_per_s'] = status['pages_done'] / status['busy_seconds'] if status['busy_seconds'] else None
+        status['updated'] = time.time()
+        return status
+
+    def write_status(self):
+        write_atomic(self.status_path, json.dumps(self.status(), indent=1).encode('utf-8'))
+        self.last_status = time.monotonic()
+
+    def run_job(self, kind, path, store):
+        from epub_extract import extract_epub
+        from ImgStitchAuto import process_images, list_images
+
+        if kind == 'epub':
+            book_dir = self.book_dir(path)
+            self.book_dirs.add(book_dir)
+            pages = len(extract_epub(path, book_dir, self.workers, store=store))
+            process_images(book_dir, os.path.join(book_dir, "Stitched"), self.workers, self.pairing,
+                           metric=self.metric, store=store)
+            with self.lock:
+                self.done_epubs[path] = list(signature(path))
+                write_atomic(self.state_path, json.dumps(self.done_epubs, indent=1).encode('utf-8'))
+            return pages
+
+        # 页面文件夹：清单里已有分数的页对不再解码，只有新页和它们的相邻页参与比较
+        pages = len(list_images(path))
+        process_images(path, os.path.join(path, "Stitched"), self.workers, self.pairing, metric=self.metric,
+                       store=store)
+        return pages
+
+    def work(self):
+        from dedup import open_store
+
+        store = open_store(self.store_path)  # SQLite 连接在使用它的线程里打开
+        try:
+            while True:
+                target = self.jobs.get()
+                if target is None:
+                    return
+                with self.lock:
+                    self.queued.discard(target)
+                    self.stats.update(state='busy', current=target[1])
+                started = time.perf_counter()
+                try:
+                    pages = self.run_job(*target, store)
+                    with self.lock:
+                        self.stats['jobs_done'] += 1
+                        self.stats['pages_done'] += pages
+                except Exception as e:
+                    print(f"Failed {target[1]}: {e}")
+                    with self.lock:
+                        self.stats['jobs_failed'] += 1
+                        self.stats['last_error'] = f"{target[1]}: {e}"
+                with self.lock:
+                    self.stats['busy_seconds'] += time.perf_counter() - started
+                    self.stats.update(state='idle', current=None)
+        finally:
+            if store:
+                store.close()
+
+    def serve_status(self):
+        watcher = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(watcher.status(), indent=1).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', self.status_port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def run(self, stop=None):
+        # stop 为 threading.Event 时可从别的线程停止；否则一直运行到 Ctrl+C
+        os.makedirs(self.output_root, exist_ok=True)
+        worker = threading.Thread(target=self.work, daemon=True)
+        worker.start()
+        server = self.serve_status() if self.status_port else None
+        print(f"Watching {self.inbox} ({type(self.source).__name__}), status: {self.status_path}")
+
+        for path in scan(self.inbox):
+            self.touch(path)
+        try:
+            while not (stop and stop.is_set()):
+                for path in self.source.changes(timeout=min(self.settle / 2, 1.0)):
+                    self.touch(path)
+                for path in self.settled():
+                    target = self.target_of(path)
+                    if target and target[0] == 'folder':
+                        self.waiting_folders.add(target[1])
+                    elif target:
+                        self.enqueue(target)
+                for target in self.folders_settled():
+                    self.enqueue(target)
+                if time.monotonic() - self.last_status >= 1.0:
+                    self.write_status()
+        except KeyboardInterrupt:
+            print("Stopping after the current job")
+        finally:
+            # 丢掉还在排队的任务，做完当前这一个就退出
+            try:
+                while True:
+                    self.jobs.get_nowait()
+            except queue.Empty:
+                pass
+            self.jobs.put(None)
+            worker.join()
+            self.source.close()
+            if server:
+                server.shutdown()
+            self.write_status()